@@ -0,0 +1,90 @@
+# toscheck/ann.py
+import os
+import numpy as np
+from toscheck.config import ANN_MIN_ROWS, ANN_NPROBE
+
+_ASSIGN_TILE = 8192
+
+
+def _assign(vecs: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Nearest centroid (by cosine) for every row, computed in tiles."""
+    out = np.empty(len(vecs), dtype=np.int64)
+    for start in range(0, len(vecs), _ASSIGN_TILE):
+        out[start:start + _ASSIGN_TILE] = np.argmax(vecs[start:start + _ASSIGN_TILE] @ centroids.T, axis=1)
+    return out
+
+
+def build_ivf(
+    vecs: np.ndarray,
+    n_lists: int | None = None,
+    iters: int = 15,
+    seed: int = 0,
+    centroids: np.ndarray | None = None,
+) -> dict:
+    """
+    Inverted-file index over L2-normalized vectors: spherical k-means
+    centroids plus, for each centroid, the rows assigned to it (stored as
+    one row array sorted by list, with offsets into it).
+    Passing previously trained `centroids` skips k-means and only reassigns.
+    """
+    n = len(vecs)
+    if n_lists is None:
+        n_lists = max(1, int(4 * np.sqrt(n)))
+    n_lists = min(n_lists, n)
+    rng = np.random.default_rng(seed)
+    if centroids is not None and centroids.shape[1] == vecs.shape[1]:
+        iters = 0
+        n_lists = len(centroids)
+    else:
+        # k-means on a sample keeps build time flat for very large corpora
+        sample = vecs[rng.choice(n, size=min(n, n_lists * 32), replace=False)]
+        centroids = sample[rng.choice(len(sample), size=n_lists, replace=False)].copy()
+    for _ in range(iters):
+        assign = _assign(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, sample)
+        empty = np.bincount(assign, minlength=n_lists) == 0
+        # re-seed empty lists with random sample points
+        sums[empty] = sample[rng.choice(len(sample), size=int(empty.sum()))]
+        centroids = sums / (np.linalg.norm(sums, axis=1, keepdims=True) + 1e-12)
+
+    assign = _assign(vecs, centroids)
+    rows = np.argsort(assign, kind="stable")
+    offsets = np.zeros(n_lists + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(np.bincount(assign, minlength=n_lists))
+    return {"centroids": centroids.astype(np.float32), "offsets": offsets, "rows": rows.astype(np.int64)}
+
+
+def save_ivf(out_dir: str, ivf: dict):
+    for name in ("centroids", "offsets", "rows"):
+        path = os.path.join(out_dir, f"ivf_{name}.npy")
+        with open(f"{path}.tmp", "wb") as f:
+            np.save(f, ivf[name])
+        os.replace(f"{path}.tmp", path)
+
+
+def remove_ivf(out_dir: str):
+    for name in ("centroids", "offsets", "rows"):
+        path = os.path.join(out_dir, f"ivf_{name}.npy")
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def load_ivf(out_dir: str) -> dict | None:
+    paths = {name: os.path.join(out_dir, f"ivf_{name}.npy") for name in ("centroids", "offsets", "rows")}
+    if not all(os.path.exists(p) for p in paths.values()):
+        return None
+    return {
+        "centroids": np.load(paths["centroids"]),
+        "offsets": np.load(paths["offsets"]),
+        "rows": np.load(paths["rows"], mmap_mode="r"),
+    }
+
+
+def candidates(ivf: dict, qv: np.ndarray, nprobe: int = ANN_NPROBE) -> np.ndarray:
+    """Row ids in the `nprobe` lists whose centroids are closest to qv."""
+    cs = ivf["centroids"] @ qv
+    nprobe = min(max(1, nprobe), len(cs))
+    lists = np.argpartition(-cs, nprobe - 1)[:nprobe]
+    offsets, rows = ivf["offsets"], ivf["rows"]
+    return np.concatenate([np.asarray(rows[offsets[l]:offsets[l + 1]]) for l in lists])
@@ -1,16 +1,12 @@
 # toscheck/app.py
+import os
 import argparse
-from dotenv import load_dotenv
 
-from toscheck.extract import read_text
-from toscheck.chunk import chunk_text
-from toscheck.index import build_and_save, load_index
-from toscheck.retrieve import retrieve
-from toscheck.llm import answer_with_rag
-from toscheck.report import write_outputs, write_explanations
-from toscheck.explain import explain_tos_with_kb
-
-load_dotenv()
+# Only light modules at import time: numpy, the OpenAI client, tqdm etc. are
+# pulled in by the command that needs them, so --help and short batch jobs
+# don't pay for the whole pipeline (bench.py checks the startup budget).
+from toscheck.config import EMB_BATCH_SIZE, EMB_CONCURRENCY, INDEX_DTYPE, ANN_NPROBE
+from toscheck import metrics
 
 
 def main():
@@ -24,12 +20,29 @@ def main():
     pidx.add_argument("--cache", default=".ragcache")
     pidx.add_argument("--max-tokens", type=int, default=500)
     pidx.add_argument("--overlap", type=int, default=150)
+    pidx.add_argument("--tokenizer", help="Token unit for --max-tokens/--overlap: words, tiktoken:<encoding> or hf:<model>")
+    pidx.add_argument("--emb-batch", type=int, default=EMB_BATCH_SIZE, help="Texts per embeddings request")
+    pidx.add_argument("--emb-concurrency", type=int, default=EMB_CONCURRENCY, help="Embedding requests in flight")
+    pidx.add_argument("--dtype", choices=["float32", "float16", "int8"], default=INDEX_DTYPE, help="On-disk vector precision")
+    pidx.add_argument("--ann", choices=["auto", "on", "off"], default="auto", help="Build an IVF index (auto: large indexes only)")
+    pidx.add_argument("--workers", type=int, default=1, help="Processes for extracting files in a directory")
+    pidx.add_argument("--file-timeout", type=float, help="Skip files whose extraction takes longer (seconds)")
+    pidx.add_argument("--sharded", action="store_true", help="Add each document as its own shard of a corpus index")
+    pidx.add_argument("--prune", action="store_true", help="With --sharded: drop shards of documents not in this input")
+    pidx.add_argument("--metrics-out", help="Also write stage timings/counters here (.prom = Prometheus text, else JSON lines)")
 
     # ask
     pask = sub.add_parser("ask", help="Ask a question against a single local RAG index")
     pask.add_argument("--query", required=True)
     pask.add_argument("--k", type=int, default=6)
+    pask.add_argument("--nprobe", type=int, default=ANN_NPROBE, help="IVF lists scanned per query (higher = better recall)")
+    pask.add_argument("--exact", action="store_true", help="Always brute-force, even if an IVF index exists")
+    pask.add_argument("--doc", action="append", help="Only search this doc_id (repeatable)")
+    pask.add_argument("--mode", choices=["dense", "lexical", "hybrid"], default="dense",
+                      help="dense = embeddings, lexical = BM25 only (no embedding server), hybrid = both fused")
     pask.add_argument("--cache", default=".ragcache")
+    pask.add_argument("--no-cache", action="store_true", help="Don't read or write the LLM response cache")
+    pask.add_argument("--metrics-out", help="Also write stage timings/counters here (.prom = Prometheus text, else JSON lines)")
     pask.add_argument("--json")
     pask.add_argument("--md")
 
@@ -42,6 +55,13 @@ def main():
     pexp.add_argument("--k-kb", type=int, default=3)
     pexp.add_argument("--kb-threshold", type=float, default=0.30)
     pexp.add_argument("--all-chunks", action="store_true")
+    pexp.add_argument("--concurrency", type=int, default=1, help="Clauses explained in parallel")
+    pexp.add_argument("--timeout", type=float, help="Per-request generation timeout in seconds")
+    pexp.add_argument("--model", help="Override generation model (env OLLAMA_GEN_MODEL default)")
+    pexp.add_argument("--no-cache", action="store_true", help="Don't read or write the LLM response cache")
+    pexp.add_argument("--batch-tokens", type=int, default=0, help="Pack several clauses into one LLM prompt of about this many tokens (0 = one per clause)")
+    pexp.add_argument("--skip-unmatched", action="store_true", help="Don't call the LLM for clauses without KB matches")
+    pexp.add_argument("--metrics-out", help="Also write stage timings/counters here (.prom = Prometheus text, else JSON lines)")
     pexp.add_argument("--md")
     pexp.add_argument("--json")
 
@@ -52,37 +72,98 @@ def main():
     pscan.add_argument("--kb-max", type=int, default=80)
     pscan.add_argument("--kb-overlap", type=int, default=20)
 
+    pscan.add_argument("--workers", type=int, default=1, help="Processes for extracting files in a directory")
+    pscan.add_argument("--file-timeout", type=float, help="Skip files whose extraction takes longer (seconds)")
+
     pscan.add_argument("--tos-file", required=True, help="TOS file to analyze (txt/pdf/html)")
     pscan.add_argument("--tos-cache", default="tos_rag")
     pscan.add_argument("--tos-max", type=int, default=120)
     pscan.add_argument("--tos-overlap", type=int, default=40)
+    pscan.add_argument("--tokenizer", help="Token unit for --kb-max/--tos-max and overlaps: words, tiktoken:<encoding> or hf:<model>")
 
     pscan.add_argument("--k-kb", type=int, default=3, help="KB hits per clause after diversification")
     pscan.add_argument("--kb-threshold", type=float, default=0.35, help="Drop weak KB matches below this score")
+    pscan.add_argument("--concurrency", type=int, default=1, help="Clauses explained in parallel")
+    pscan.add_argument("--timeout", type=float, help="Per-request generation timeout in seconds")
     pscan.add_argument("--model", help="Override generation model (env OLLAMA_GEN_MODEL default)")
+    pscan.add_argument("--no-cache", action="store_true", help="Don't read or write the LLM response cache")
+    pscan.add_argument("--batch-tokens", type=int, default=0, help="Pack several clauses into one LLM prompt of about this many tokens (0 = one per clause)")
+    pscan.add_argument("--skip-unmatched", action="store_true", help="Don't call the LLM for clauses without KB matches")
+    pscan.add_argument("--prescreen", action="store_true",
+                       help="Only send clauses flagged by the seeds.yml/KB signal rules (or close KB matches) to the LLM")
+    pscan.add_argument("--seeds", default="seeds.yml", help="Seed patterns for --prescreen")
+    pscan.add_argument("--prescreen-kb-score", type=float,
+                       help="With --prescreen, clauses no rule flags still go to the LLM if their best KB match scores this well (default: --kb-threshold)")
+    pscan.add_argument("--emb-batch", type=int, default=EMB_BATCH_SIZE, help="Texts per embeddings request")
+    pscan.add_argument("--emb-concurrency", type=int, default=EMB_CONCURRENCY, help="Embedding requests in flight")
+    pscan.add_argument("--dtype", choices=["float32", "float16", "int8"], default=INDEX_DTYPE, help="On-disk vector precision")
 
+    pscan.add_argument("--metrics-out", help="Also write stage timings/counters here (.prom = Prometheus text, else JSON lines)")
     pscan.add_argument("--md", default="scan_report.md")
     pscan.add_argument("--json", default="scan_report.json")
+    pscan.add_argument("--jsonl", default="scan_report.jsonl", help="Per-clause results, appended as they finish; doubles as the resume checkpoint")
+    pscan.add_argument("--no-resume", action="store_true", help="Start the report over instead of skipping clauses finished by an interrupted run")
+
+    # serve: long-running local API with warm indexes
+    psrv = sub.add_parser("serve", help="Serve ask/explain/index over a local HTTP API with warm indexes")
+    psrv.add_argument("--host", default="127.0.0.1")
+    psrv.add_argument("--port", type=int, default=8000)
+    psrv.add_argument("--cache", default=".ragcache", help="Default document index for requests")
+    psrv.add_argument("--kb", default="kb_rag", help="Default KB index for /explain")
+    psrv.add_argument("--mode", choices=["dense", "lexical", "hybrid"], default="dense", help="Default retrieval mode for /ask")
 
     args = parser.parse_args()
+    # scan reports its stage breakdown and serve exposes /metrics; others only when asked
+    if args.cmd in ("scan", "serve") or getattr(args, "metrics_out", None):
+        metrics.enable()
 
     if args.cmd == "index":
+        from toscheck.extract import iter_documents
+        from toscheck.chunk import chunk_document, iter_document_chunks
+        from toscheck.index import build_from_stream, build_corpus
+
         print("📦 Building index...")
-        text = read_text(args.input, args.url)
-        chunks = chunk_text(text, max_tokens=args.max_tokens, overlap=args.overlap)
-        build_and_save(chunks, out_dir=args.cache)
-        print(f"✅ Indexed {len(chunks)} chunks → {args.cache}")
+        docs = iter_documents(args.input, args.url, workers=args.workers, timeout=args.file_timeout)
+        ann = {"auto": None, "on": True, "off": False}[args.ann]
+        if args.sharded:
+            def shards():
+                for d in docs:
+                    c, m = chunk_document(d, max_tokens=args.max_tokens, overlap=args.overlap, tokenizer=args.tokenizer)
+                    yield {"doc_id": d["doc_id"], "source": d["source"], "chunks": c, "meta": m}
+            st = build_corpus(shards(), out_dir=args.cache, prune=args.prune, ann=ann, batch_size=args.emb_batch,
+                              concurrency=args.emb_concurrency, dtype=args.dtype)
+            print(f"✅ Indexed {st['shards_written'] + st['shards_unchanged']} documents → {args.cache} "
+                  f"({st['shards_written']} shards written, {st['shards_unchanged']} unchanged; "
+                  f"reused {st['reused']}, added {st['added']}, removed {st['removed']})")
+        else:
+            # extraction -> chunking -> embedding as one stream; chunks are embedded
+            # while later files are still being extracted
+            items = iter_document_chunks(docs, max_tokens=args.max_tokens, overlap=args.overlap,
+                                         tokenizer=args.tokenizer)
+            st = build_from_stream(items, out_dir=args.cache, batch_size=args.emb_batch, concurrency=args.emb_concurrency,
+                                   dtype=args.dtype, ann=ann, with_meta=True)
+            print(f"✅ Indexed {st['reused'] + st['added']} chunks → {args.cache} "
+                  f"(reused {st['reused']}, added {st['added']}, removed {st['removed']})")
 
     elif args.cmd == "ask":
+        from toscheck.index import load_index
+        from toscheck.retrieve import retrieve
+        from toscheck.llm import answer_with_rag
+        from toscheck.report import write_outputs
+
         print("❓ Running query...")
         data = load_index(out_dir=args.cache)
-        results = retrieve(args.query, data, k=args.k)
-        answer = answer_with_rag(args.query, results)
+        results = retrieve(args.query, data, k=args.k, nprobe=args.nprobe, exact=True if args.exact else None,
+                           docs=args.doc, mode=args.mode)
+        answer = answer_with_rag(args.query, results, use_cache=not args.no_cache)
         write_outputs(args.query, results, answer, json_path=args.json, md_path=args.md)
         print("🧠 Answer:\n")
         print(answer)
 
     elif args.cmd == "explain":
+        from toscheck.explain import explain_tos_with_kb
+        from toscheck.report import write_explanations
+
         print("🧩 Running dual-RAG explanation...")
         results = explain_tos_with_kb(
             query=args.query,
@@ -92,6 +173,12 @@ def main():
             k_kb=args.k_kb,
             all_chunks=args.all_chunks,
             kb_score_threshold=args.kb_threshold,
+            concurrency=args.concurrency,
+            timeout=args.timeout,
+            model=args.model,
+            use_cache=not args.no_cache,
+            batch_tokens=args.batch_tokens,
+            skip_unmatched=args.skip_unmatched,
         )
         combined = "\n\n".join(r.get("answer", "") for r in results)
         write_explanations(args.query, results, json_path=args.json, md_path=args.md)
@@ -99,41 +186,123 @@ def main():
         print(combined)
 
     elif args.cmd == "scan":
+        from toscheck.extract import iter_documents
+        from toscheck.chunk import iter_document_chunks
+        from toscheck.index import build_from_stream, index_digest
+        from toscheck.explain import explain_tos_with_kb
+        from toscheck.llm import GEN_MODEL
+        from toscheck.report import write_explanations, ExplanationStream
+        from toscheck.cache import get_embedding_cache
+        from toscheck.rules import load_rules
+
         # 1) Index KB
         print("📚 Indexing KB…")
-        kb_text = read_text(args.kb_dir, None)
-        from toscheck.chunk import chunk_text  # uses dynamic chunker underneath
-        kb_chunks = chunk_text(kb_text, max_tokens=args.kb_max, overlap=args.kb_overlap)
-        build_and_save(kb_chunks, out_dir=args.kb_cache)
-        print(f"✅ KB: {len(kb_chunks)} chunks → {args.kb_cache}")
+        with metrics.span("scan.kb_index"):
+            kb_docs = iter_documents(args.kb_dir, None, workers=args.workers, timeout=args.file_timeout)
+            kb_items = iter_document_chunks(kb_docs, max_tokens=args.kb_max, overlap=args.kb_overlap,
+                                            tokenizer=args.tokenizer)
+            st = build_from_stream(kb_items, out_dir=args.kb_cache, batch_size=args.emb_batch,
+                                   concurrency=args.emb_concurrency, dtype=args.dtype, with_meta=True)
+            print(f"✅ KB: {st['reused'] + st['added']} chunks → {args.kb_cache} "
+                  f"(reused {st['reused']}, added {st['added']}, removed {st['removed']})")
 
         # 2) Index TOS file
         print("📄 Indexing TOS…")
-        tos_text = read_text(args.tos_file, None)
-        tos_chunks = chunk_text(tos_text, max_tokens=args.tos_max, overlap=args.tos_overlap)
-        build_and_save(tos_chunks, out_dir=args.tos_cache)
-        print(f"✅ TOS: {len(tos_chunks)} chunks → {args.tos_cache}")
+        with metrics.span("scan.tos_index"):
+            tos_docs = iter_documents(args.tos_file, None, workers=args.workers, timeout=args.file_timeout)
+            tos_items = iter_document_chunks(tos_docs, max_tokens=args.tos_max, overlap=args.tos_overlap,
+                                             tokenizer=args.tokenizer)
+            st = build_from_stream(tos_items, out_dir=args.tos_cache, batch_size=args.emb_batch,
+                                   concurrency=args.emb_concurrency, dtype=args.dtype, with_meta=True)
+            print(f"✅ TOS: {st['reused'] + st['added']} chunks → {args.tos_cache} "
+                  f"(reused {st['reused']}, added {st['added']}, removed {st['removed']})")
 
-        # 3) Explain all chunks against KB
+        # 3) Explain all chunks against KB, streaming each clause to the report.
+        # Anything that changes answers for unchanged clause text goes in the
+        # checkpoint settings; edited clauses are caught by their text.
         print("🧩 Explaining…")
-        results = explain_tos_with_kb(
-            query="Full risk review",
-            tos_cache=args.tos_cache,
-            kb_cache=args.kb_cache,
-            k_tos=9999,            # ignored because we force all_chunks=True
-            k_kb=args.k_kb,
-            all_chunks=True,       # explain EVERY clause
-            kb_score_threshold=args.kb_threshold,
-        )
+        stats = {}
+        rules = None
+        if args.prescreen:
+            if not os.path.exists(args.seeds):
+                print(f"⚠️  {args.seeds} not found; pre-screening with the KB signals only")
+            rules = load_rules(args.seeds, args.kb_dir)
+        settings = {
+            "kb_index": index_digest(args.kb_cache),
+            "model": args.model or GEN_MODEL,
+            "k_kb": args.k_kb,
+            "kb_threshold": args.kb_threshold,
+            "skip_unmatched": args.skip_unmatched,
+            "prescreen": args.prescreen,
+            "prescreen_kb_score": args.prescreen_kb_score,
+            # editing seeds.yml or the KB signals must not keep stale "clean" verdicts
+            "rules": rules.digest if rules is not None else None,
+        }
+        out = ExplanationStream("Full risk review", args.jsonl, args.md, settings, resume=not args.no_resume)
+        if out.done:
+            print(f"↩️  Resuming: {len(out.done)} clauses already in {args.jsonl}")
+        with out:
+            with metrics.span("scan.explain"):
+                results = explain_tos_with_kb(
+                    query="Full risk review",
+                    tos_cache=args.tos_cache,
+                    kb_cache=args.kb_cache,
+                    k_tos=9999,            # ignored because we force all_chunks=True
+                    k_kb=args.k_kb,
+                    all_chunks=True,       # explain EVERY clause
+                    kb_score_threshold=args.kb_threshold,
+                    concurrency=args.concurrency,
+                    timeout=args.timeout,
+                    model=args.model,
+                    use_cache=not args.no_cache,
+                    batch_tokens=args.batch_tokens,
+                    skip_unmatched=args.skip_unmatched,
+                    prescreen=rules,
+                    prescreen_kb_score=args.prescreen_kb_score,
+                    resume=out.done,
+                    on_result=out.write,
+                    stats=stats,
+                )
+            emb_cache = get_embedding_cache()
+            if emb_cache is not None:
+                stats["embedding_cache"] = emb_cache.stats()
+            stats["metrics"] = metrics.snapshot()
+            out.close(stats)
         combined = "\n\n".join(r.get("answer", "") for r in results)
-        write_explanations("Full risk review", results, json_path=args.json, md_path=args.md)
-        print(f"✅ Wrote: {args.md} and {args.json}")
+        write_explanations("Full risk review", results, json_path=args.json, md_path=None, stats=stats)
+        print(f"✅ Wrote: {args.md}, {args.jsonl} and {args.json}")
+        print(f"🧮 {stats['clauses']} clauses, {stats['unique_prompts']} distinct prompts")
+        if "batches" in stats:
+            print(f"📦 {stats['batches']} batched requests ({stats['batch_fallbacks']} clauses retried alone)")
+        if "prescreen" in stats:
+            ps = stats["prescreen"]
+            print(f"🚦 Pre-screen: {ps['flagged']} clauses flagged by rules, {ps['clean']} clean prompts not sent to the LLM")
+        if stats["skipped_unmatched"]:
+            print(f"⏭️  {stats['skipped_unmatched']} prompts without KB matches skipped")
+        spans = stats["metrics"]["spans"]
+        # stages overlap while indexing (extraction runs alongside embedding)
+        print("⏱️  " + " · ".join(f"{k} {spans[k]['seconds']:.2f}s"
+                                  for k in ("extract", "chunk", "embed", "index_write", "match", "generate") if k in spans))
+        for name in ("embedding_cache", "generation_cache"):
+            if name in stats:
+                st = stats[name]
+                label = name.replace("_", " ").capitalize()
+                print(f"🗃️  {label}: {st['hits']} hits / {st['misses']} misses (hit rate {st['hit_rate']:.0%})")
         print("🧠 Explanation Summary:\n")
         print(combined)
 
+    elif args.cmd == "serve":
+        from toscheck.server import serve
+
+        serve(host=args.host, port=args.port, cache=args.cache, kb=args.kb, mode=args.mode)
+
     else:
         parser.print_help()
 
+    if getattr(args, "metrics_out", None):
+        metrics.write(args.metrics_out)
+        print(f"📈 Metrics → {args.metrics_out}")
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,583 @@
+# toscheck/bench.py
+"""
+Benchmark harness for the chunk → index → load → retrieve → explain pipeline.
+
+Runs every stage against a local stub OpenAI-compatible server (deterministic
+embeddings, canned chat answers, configurable latency) over synthetic TOS
+corpora of increasing size, records wall time and peak traced memory per
+stage, writes the results as JSON and optionally compares them against a
+stored baseline:
+
+    python -m toscheck.bench --sizes 50,200,800 --out bench_results.json
+    python -m toscheck.bench --save-baseline bench_baseline.json
+    python -m toscheck.bench --baseline bench_baseline.json   # exit 1 on regression
+    python -m toscheck.bench --startup-only                    # just the CLI import budget
+    python -m toscheck.bench --chunker-only                    # just the chunker golden check
+    python -m toscheck.bench --prescreen-only                  # just the rule pre-screen samples
+"""
+import os
+import io
+import sys
+import json
+import time
+import re
+import random
+import hashlib
+import platform
+import argparse
+import tempfile
+import tracemalloc
+import subprocess
+import multiprocessing as mp
+from contextlib import redirect_stdout, redirect_stderr, nullcontext
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import numpy as np
+
+STAGES = ("chunk", "index", "load", "retrieve", "retrieve_lexical", "explain")
+# must not be imported just by loading the CLI (see app.py)
+HEAVY_MODULES = ("numpy", "openai", "httpx", "tqdm", "sqlite3", "trafilatura", "pdfminer")
+
+
+# ---------- stub server ----------
+
+def _stub_vector(text: str, dim: int) -> list[float]:
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    return np.random.default_rng(seed).standard_normal(dim, dtype=np.float32).tolist()
+
+
+def _serve_stub(port_q, latency: float, dim: int):
+    """Minimal /v1/embeddings + /v1/chat/completions server; runs in its own process."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            if latency:
+                time.sleep(latency)
+            if self.path.endswith("/embeddings"):
+                inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+                out = {
+                    "object": "list",
+                    "model": body["model"],
+                    "data": [{"object": "embedding", "index": i, "embedding": _stub_vector(t, dim)}
+                             for i, t in enumerate(inputs)],
+                    "usage": {"prompt_tokens": 0, "total_tokens": 0},
+                }
+            elif self.path.endswith("/chat/completions"):
+                prompt = body["messages"][-1]["content"]
+                digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:8]
+                out = {
+                    "id": f"stub-{digest}",
+                    "object": "chat.completion",
+                    "created": 0,
+                    "model": body["model"],
+                    "choices": [{"index": 0, "finish_reason": "stop", "message": {
+                        "role": "assistant",
+                        "content": f"Stub summary {digest}.\n- risk\nLikely category: Other",
+                    }}],
+                }
+            else:
+                self.send_error(404)
+                return
+            data = json.dumps(out).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    port_q.put(server.server_address[1])
+    server.serve_forever()
+
+
+def start_stub(latency: float = 0.0, dim: int = 768):
+    """Start the stub server in a child process; returns (process, base_url)."""
+    port_q = mp.Queue()
+    proc = mp.Process(target=_serve_stub, args=(port_q, latency, dim), daemon=True)
+    proc.start()
+    return proc, f"http://127.0.0.1:{port_q.get(timeout=30)}/v1"
+
+
+# ---------- synthetic corpora ----------
+
+_CLAUSES = [
+    "We may modify these Terms at any time without prior notice to you.",
+    "Any dispute shall be resolved by binding arbitration on an individual basis; you waive any right to a class action.",
+    "You grant us a worldwide, royalty-free, perpetual license to use, copy and distribute your content.",
+    "We collect device identifiers, location data and browsing history to personalize advertising.",
+    "We may share your personal information with our partners and affiliates for marketing purposes.",
+    "All fees are non-refundable, including for partially used subscription periods.",
+    "We may suspend or terminate your account at our sole discretion and for any reason.",
+    "Your continued use of the Service after changes constitutes acceptance of the revised Terms.",
+    "We retain your data for as long as necessary for our business purposes.",
+    "The Service is provided as is, without warranties of any kind, express or implied.",
+]
+_FILLER = ("service user account content data information provider agreement section party "
+           "third access use policy rights notice law applicable period material").split()
+
+_KB = {
+    "arbitration.txt": "Forced arbitration clauses require disputes to go to a private arbitrator and often waive class actions.",
+    "unilateral_changes.txt": "Unilateral change clauses let the company modify terms at any time, sometimes without notice.",
+    "refund.txt": "No-refund clauses deny refunds for unused periods or cancelled subscriptions.",
+    "content_rights.txt": "Broad content licenses grant the company perpetual, royalty-free rights to user content.",
+    "data_collection.txt": "Data collection clauses describe tracking of location, device identifiers and browsing history.",
+    "data_sharing.txt": "Data sharing clauses allow personal information to be shared with partners and affiliates.",
+}
+
+_QUERIES = [
+    "Can they change the terms without telling me?",
+    "Do I give up my right to sue?",
+    "What do they do with my content?",
+    "Is my location tracked?",
+    "Can I get a refund?",
+]
+
+
+def synthetic_tos(n_paragraphs: int, seed: int = 0) -> str:
+    """TOS-like text: numbered sections of clause sentences mixed with filler, some boilerplate repeated."""
+    rng = random.Random(seed)
+    paras = []
+    for i in range(n_paragraphs):
+        if i % 8 == 0:
+            paras.append(f"{i // 8 + 1}. SECTION {i // 8 + 1}")
+        sentences = []
+        for _ in range(rng.randint(2, 6)):
+            if rng.random() < 0.5:
+                sentences.append(rng.choice(_CLAUSES))
+            else:
+                words = [rng.choice(_FILLER) for _ in range(rng.randint(8, 25))]
+                sentences.append(words[0].capitalize() + " " + " ".join(words[1:]) + ".")
+        paras.append(" ".join(sentences))
+    return "\n\n".join(paras)
+
+
+# ---------- measurement ----------
+
+def _measure(fn, quiet: bool):
+    """(result, seconds, peak traced MB) for one call of fn."""
+    sink = io.StringIO()
+    ctx_out = redirect_stdout(sink) if quiet else nullcontext()
+    ctx_err = redirect_stderr(sink) if quiet else nullcontext()
+    tracemalloc.reset_peak()
+    base = tracemalloc.get_traced_memory()[0]
+    with ctx_out, ctx_err:
+        t0 = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - t0
+    peak = tracemalloc.get_traced_memory()[1] - base
+    return result, elapsed, max(peak, 0) / 1e6
+
+
+def run(sizes: list[int], workdir: str, queries: int, concurrency: int, emb_batch: int, emb_concurrency: int,
+        dtype: str, quiet: bool = True) -> list[dict]:
+    """Run every stage for every corpus size. Expects OPENAI_BASE_URL to point at the stub already."""
+    # imported here so the clients pick up the stub URL and cache settings from the environment
+    from toscheck.chunk import chunk_text
+    from toscheck.index import build_and_save, load_index
+    from toscheck.retrieve import retrieve
+    from toscheck.explain import explain_tos_with_kb
+
+    kb_dir = os.path.join(workdir, "kb")
+    kb_chunks = [c for text in _KB.values() for c in chunk_text(text, max_tokens=80, overlap=20)]
+    _measure(lambda: build_and_save(kb_chunks, out_dir=kb_dir, dtype=dtype), quiet)
+
+    results = []
+    for size in sizes:
+        text = synthetic_tos(size, seed=size)
+        out_dir = os.path.join(workdir, f"tos_{size}")
+        qs = [_QUERIES[i % len(_QUERIES)] + f" ({i})" for i in range(queries)]
+        data = {}
+
+        stages = {
+            "chunk": lambda: chunk_text(text, max_tokens=120, overlap=40),
+            "index": lambda: build_and_save(data["chunks"], out_dir=out_dir, batch_size=emb_batch,
+                                            concurrency=emb_concurrency, dtype=dtype),
+            "load": lambda: load_index(out_dir),
+            "retrieve": lambda: [retrieve(q, data["index"], k=6) for q in qs],
+            "retrieve_lexical": lambda: [retrieve(q, data["index"], k=6, mode="lexical") for q in qs],
+            "explain": lambda: explain_tos_with_kb("Full risk review", out_dir, kb_dir, all_chunks=True,
+                                                   concurrency=concurrency, use_cache=False),
+        }
+        for stage in STAGES:
+            out, seconds, peak_mb = _measure(stages[stage], quiet)
+            if stage == "chunk":
+                data["chunks"] = out
+                items = len(out)
+            elif stage == "load":
+                data["index"] = out
+                items = len(out["chunks"])
+            elif stage in ("retrieve", "retrieve_lexical"):
+                items = len(qs)
+            elif stage == "explain":
+                items = len(out)
+            else:
+                items = len(data["chunks"])
+            results.append({
+                "size": size,
+                "stage": stage,
+                "items": items,
+                "seconds": round(seconds, 4),
+                "items_per_sec": round(items / seconds, 1) if seconds > 0 else None,
+                "peak_mb": round(peak_mb, 2),
+            })
+            print(f"  {size:>6} paras  {stage:<16} {seconds:8.3f}s  {peak_mb:8.2f} MB  ({items} items)")
+    return results
+
+
+def check_startup(runs: int = 5) -> dict:
+    """
+    Import cost of the CLI in fresh interpreters: best-of-`runs` seconds for
+    `import toscheck.app`, and which HEAVY_MODULES that import pulled in.
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, (root, os.environ.get("PYTHONPATH")))))
+    code = (
+        "import sys, time, json\n"
+        "t = time.perf_counter()\n"
+        "import toscheck.app\n"
+        "dt = time.perf_counter() - t\n"
+        f"print(json.dumps({{'seconds': dt, 'heavy': [m for m in {HEAVY_MODULES!r} if m in sys.modules]}}))\n"
+    )
+    best, heavy = None, []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True, check=True)
+        r = json.loads(out.stdout.strip().splitlines()[-1])
+        best = r["seconds"] if best is None else min(best, r["seconds"])
+        heavy = sorted(set(heavy) | set(r["heavy"]))
+    return {"import_seconds": round(best, 4), "heavy_modules": heavy}
+
+
+def _reference_dynamic_chunk(text: str, max_tokens: int, soft_min_tokens: int, overlap: int) -> list[str]:
+    """chunk.dynamic_chunk as it was before the streaming rewrite, kept verbatim as the golden reference."""
+    paras = [p.strip() for p in re.split(r"\n\s*\n", text) if p.strip()]
+    out = []
+
+    def tokens(s: str) -> int:
+        return len(s.split())
+
+    for p in paras:
+        parts = re.split(r"(?<=[.!?;])\s+(?=[A-Z0-9(])", p)
+        cur = []
+        cur_tok = 0
+        for s in parts:
+            s_tok = tokens(s)
+            if cur_tok + s_tok > max_tokens and cur_tok >= soft_min_tokens:
+                piece = " ".join(cur).strip()
+                if piece:
+                    out.append(piece)
+                tail = " ".join(piece.split()[-overlap:])
+                cur = [tail, s]
+                cur_tok = tokens(tail) + s_tok
+            else:
+                cur.append(s)
+                cur_tok += s_tok
+        if cur:
+            piece = " ".join(cur).strip()
+            if tokens(piece) < soft_min_tokens and out:
+                prev = out.pop()
+                merged = (prev + " " + piece).strip()
+                if tokens(merged) <= max_tokens + overlap:
+                    out.append(merged)
+                else:
+                    out.append(prev)
+                    out.append(piece)
+            else:
+                out.append(piece)
+
+    if len(out) >= 2 and tokens(out[-1]) < soft_min_tokens:
+        last = out.pop()
+        out[-1] = (out[-1] + " " + last).strip()
+
+    return [c for i, c in enumerate(out) if c and (i == 0 or c != out[i-1])]
+
+
+_CHUNK_WORDS = ["We", "may", "change", "terms.", "Arbitration;", "the", "You", "(a)", "1.", "data", "share",
+                "x.", "Y!", "waive", "rights?", "\t", "Section", "3;"]
+_CHUNK_PARAMS = [(10, 3, 2), (30, 10, 5), (120, 40, 40), (500, 166, 150), (5, 1, 0), (20, 15, 30), (20, 6, -2)]
+
+
+def check_chunker(cases: int = 500, seed: int = 0, timing_sentences: int = 40000) -> dict:
+    """
+    Golden check for chunk.dynamic_chunk: its output must equal the pre-rewrite
+    implementation's on random texts (odd spacing, sentence and semicolon
+    boundaries, tiny and huge paragraphs) for several max/min/overlap
+    settings. Also times both on one long single-paragraph text and on many
+    short paragraphs (best of 5 each).
+    """
+    from toscheck.chunk import dynamic_chunk
+    rng = random.Random(seed)
+    texts = [synthetic_tos(40, seed=seed)]
+    for _ in range(cases):
+        paras = [" ".join(rng.choice(_CHUNK_WORDS) for _ in range(rng.randint(0, 150)))
+                 for _ in range(rng.randint(0, 12))]
+        texts.append(rng.choice(["\n\n", "\n \n", "\n\n\n"]).join(paras))
+    checked, mismatches, first = 0, 0, None
+    for text in texts:
+        for params in _CHUNK_PARAMS:
+            checked += 1
+            if dynamic_chunk(text, *params) != _reference_dynamic_chunk(text, *params):
+                mismatches += 1
+                first = first or {"text": text[:200], "params": params}
+
+    filler = "we may change these terms at any time without notice and you agree".split()
+    sentence = lambda: " ".join(rng.choice(filler) for _ in range(rng.randint(5, 20))).capitalize() + "."
+    timing = {
+        "one_paragraph": " ".join(sentence() for _ in range(timing_sentences)),
+        "many_paragraphs": "\n\n".join(" ".join(sentence() for _ in range(rng.randint(1, 6)))
+                                        for _ in range(timing_sentences // 4)),
+    }
+    seconds = {}
+    for name, text in timing.items():
+        for label, fn in (("reference", _reference_dynamic_chunk), ("current", dynamic_chunk)):
+            runs = []
+            for _ in range(5):
+                t = time.perf_counter()
+                fn(text, 120, 40, 40)
+                runs.append(time.perf_counter() - t)
+            seconds[f"{name}_{label}"] = round(min(runs), 4)
+    return {"checked": checked, "mismatches": mismatches, "first_mismatch": first, "seconds": seconds}
+
+
+# everyday TOS clauses; the second half uses signal words ("monitor", "sell", "fees") harmlessly
+_PRESCREEN_BENIGN = (
+    "If you do not agree to these Terms, do not use the Services.",
+    "Please contact customer support during business hours if you have questions.",
+    "These Terms are written in English and any translation is provided for convenience only.",
+    "You must be at least 18 years old to create an account.",
+    "You are responsible for keeping your password confidential and for all activity under your account.",
+    "The Service is provided by Example Inc., a company registered in Ireland.",
+    "We aim to respond to support requests within two business days.",
+    "If any provision of these Terms is held invalid, the remaining provisions remain in full force and effect.",
+    "Our website may contain links to third party websites that we do not control.",
+    "You can update your personal information at any time from your account settings.",
+    "Section headings are for convenience only and have no legal effect.",
+    "We use your email address to send you receipts and service announcements.",
+    "You may not reverse engineer or decompile the software.",
+    "These Terms constitute the entire agreement between you and us regarding the Service.",
+    "Our failure to enforce any right is not a waiver of that right.",
+    "You can download a copy of your data from the settings page.",
+    "We will respond to your request within 30 days.",
+    "The fees for each plan are listed on our pricing page.",
+    "You may close your account at any time by clicking Delete Account in settings.",
+    "We record the date and time you accepted these Terms.",
+    "We monitor service uptime and publish incidents on our status page.",
+    "Fees are shown in US dollars and include applicable taxes.",
+    "Our offices are located worldwide, and our support team works in several time zones.",
+    "We keep a record of your orders so you can view them later.",
+    "You can change your notification preferences at any time.",
+    "If you cancel, you keep access until the end of the billing period.",
+    "We will give you 30 days notice before any change to your plan price takes effect.",
+    "You own the content you upload; we only use it to operate the Service for you.",
+    "We collect only the information needed to process your order.",
+    "You may request a refund within 30 days of purchase.",
+    "We do not sell your personal information.",
+    "We never share your data with advertisers.",
+    "Either party may terminate this agreement with 30 days written notice.",
+    "Any notices to you will be sent to the email address on your account.",
+    "You may opt out of marketing emails by clicking unsubscribe.",
+    "We use strictly necessary cookies to keep you signed in.",
+    "Please read our Privacy Policy, which explains how we handle your data.",
+    "You can delete your account and all associated data at any time.",
+    "The courts of your home country have jurisdiction over consumer disputes.",
+    "We may update the app to fix bugs and improve performance.",
+)
+# a paraphrase for most seeds.yml categories, then clauses only the KB signals catch
+_PRESCREEN_RISKY = (
+    "We may change these Terms at any time without prior notice or consent.",
+    "We reserve the right to modify this agreement at our sole discretion.",
+    "Any dispute shall be resolved by binding arbitration on an individual basis.",
+    "You waive any right to participate in a class action or jury trial.",
+    "This agreement is governed by the laws of the State of California.",
+    "We may terminate your account at our sole discretion, for any reason or no reason at all.",
+    "The service is provided \"as is\" without any warranties of any kind.",
+    "We are not liable for any indirect, incidental, or consequential damages.",
+    "Our total liability is limited to the amount you paid us in the last 12 months.",
+    "You agree to indemnify and hold us harmless from any claims arising out of your use.",
+    "Subscriptions automatically renew each month unless canceled.",
+    "To cancel, you must call our customer support line.",
+    "Cancellation requests must be sent in writing by postal mail.",
+    "We reserve the right to increase prices or fees with or without notice.",
+    "All payments are non-refundable.",
+    "You grant us a perpetual, worldwide, royalty-free license to use your content.",
+    "We collect personal information including your location and contact details.",
+    "We may process biometric identifiers such as faceprints.",
+    "The app accesses your device location, camera, and microphone.",
+    "We may share your personal information with our affiliates and third parties.",
+    "We may sell personal information to our partners.",
+    "We use your data for targeted advertising and profiling.",
+    "We use cookies and third-party pixels for analytics and advertising.",
+    "We do not honor Do Not Track signals.",
+    "Your data may be transferred outside your country of residence.",
+    "We retain your data as long as necessary for business purposes.",
+    "Deleting your account does not delete your data.",
+    "Our service is not directed to children under 13.",
+    "We will notify you of changes by posting updates on this page.",
+    "To opt out, print and mail your request to our office.",
+    "We may monitor and record your keystrokes and screen activity.",
+    "Your content may be used for AI training.",
+    "We may share your personal information with third parties for advertising purposes.",
+    "We collect your precise location and browsing history.",
+    "We may monitor your communications.",
+)
+
+
+def check_prescreen(seeds: str = "seeds.yml", patterns_dir: str = "rag_patterns") -> dict:
+    """
+    How the rule pre-screen (rules.py) does on hand-written clauses: risky
+    ones it misses skip the LLM under --prescreen, benign ones it flags only
+    cost an LLM call.
+    """
+    from toscheck.rules import load_rules
+    rules = load_rules(seeds, patterns_dir)
+    benign = [t for t, f in zip(_PRESCREEN_BENIGN, rules.scan(_PRESCREEN_BENIGN)) if f]
+    missed = [t for t, f in zip(_PRESCREEN_RISKY, rules.scan(_PRESCREEN_RISKY)) if not f]
+    return {"benign": len(_PRESCREEN_BENIGN), "benign_flagged": benign,
+            "risky": len(_PRESCREEN_RISKY), "risky_missed": missed}
+
+
+def compare(results: list[dict], baseline: dict, tolerance: float, min_seconds: float) -> list[str]:
+    """Human-readable regressions of `results` against a baseline payload (empty if none)."""
+    base = {(r["size"], r["stage"]): r for r in baseline.get("results", [])}
+    regressions = []
+    for r in results:
+        b = base.get((r["size"], r["stage"]))
+        if b is None:
+            continue
+        # very short stages are mostly noise
+        if max(r["seconds"], b["seconds"]) >= min_seconds and r["seconds"] > b["seconds"] * (1 + tolerance):
+            regressions.append(f"{r['stage']} @ {r['size']}: {b['seconds']:.3f}s → {r['seconds']:.3f}s "
+                               f"(+{r['seconds'] / b['seconds'] - 1:.0%})")
+        if b["peak_mb"] >= 1 and r["peak_mb"] > b["peak_mb"] * (1 + tolerance):
+            regressions.append(f"{r['stage']} @ {r['size']}: peak {b['peak_mb']:.1f} MB → {r['peak_mb']:.1f} MB "
+                               f"(+{r['peak_mb'] / b['peak_mb'] - 1:.0%})")
+    return regressions
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser("toscheck-bench")
+    parser.add_argument("--sizes", default="50,200,800", help="Comma-separated corpus sizes, in paragraphs")
+    parser.add_argument("--queries", type=int, default=20, help="retrieve() calls per size")
+    parser.add_argument("--latency", type=float, default=0.005, help="Stub server latency per request (seconds)")
+    parser.add_argument("--dim", type=int, default=768, help="Stub embedding dimension")
+    parser.add_argument("--concurrency", type=int, default=4, help="Clauses explained in parallel")
+    parser.add_argument("--emb-batch", type=int, default=32)
+    parser.add_argument("--emb-concurrency", type=int, default=4)
+    parser.add_argument("--dtype", choices=["float32", "float16", "int8"], default="float32")
+    parser.add_argument("--out", default="bench_results.json", help="Where to write this run's results")
+    parser.add_argument("--baseline", help="Compare against this results file; exit 1 on regression")
+    parser.add_argument("--save-baseline", help="Also write this run's results here")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown/growth vs baseline (0.25 = 25%%)")
+    parser.add_argument("--min-seconds", type=float, default=0.05, help="Ignore timing changes of stages shorter than this")
+    parser.add_argument("--verbose", action="store_true", help="Show the pipeline's own output")
+    parser.add_argument("--import-budget-ms", type=float, default=150,
+                        help="Fail if importing the CLI takes longer than this (or loads heavy modules)")
+    parser.add_argument("--startup-only", action="store_true", help="Only run the CLI import budget check")
+    parser.add_argument("--chunker-only", action="store_true", help="Only run the chunker golden check")
+    parser.add_argument("--prescreen-only", action="store_true", help="Only run the rule pre-screen sample check")
+    parser.add_argument("--prescreen-min-risky", type=float, default=0.9,
+                        help="Fail if the pre-screen flags a smaller share of the risky samples")
+    parser.add_argument("--prescreen-max-benign", type=float, default=0.4,
+                        help="Fail if the pre-screen flags a larger share of the benign samples")
+    args = parser.parse_args(argv)
+
+    startup, startup_ok = None, True
+    if not (args.chunker_only or args.prescreen_only):
+        startup = check_startup()
+        over = startup["import_seconds"] * 1000 > args.import_budget_ms
+        startup_ok = not over and not startup["heavy_modules"]
+        print(f"{'✅' if startup_ok else '❌'} CLI import: {startup['import_seconds'] * 1000:.1f} ms "
+              f"(budget {args.import_budget_ms:g} ms)"
+              + (f", heavy modules loaded: {', '.join(startup['heavy_modules'])}" if startup["heavy_modules"] else ""))
+        if args.startup_only:
+            return 0 if startup_ok else 1
+
+    chunker, chunker_ok = None, True
+    if not args.prescreen_only:
+        chunker = check_chunker()
+        chunker_ok = chunker["mismatches"] == 0
+        sec = chunker["seconds"]
+        print(f"{'✅' if chunker_ok else '❌'} Chunker golden check: {chunker['mismatches']} mismatches in "
+              f"{chunker['checked']} cases; one paragraph {sec['one_paragraph_reference']:.3f}s → "
+              f"{sec['one_paragraph_current']:.3f}s, many paragraphs {sec['many_paragraphs_reference']:.3f}s → "
+              f"{sec['many_paragraphs_current']:.3f}s (reference → current)")
+        if not chunker_ok:
+            print(f"   first mismatch: {chunker['first_mismatch']}")
+        if args.chunker_only:
+            return 0 if chunker_ok else 1
+
+    prescreen, prescreen_ok = None, True
+    if not args.chunker_only:
+        prescreen = check_prescreen()
+        flagged, missed = len(prescreen["benign_flagged"]), len(prescreen["risky_missed"])
+        prescreen_ok = flagged <= args.prescreen_max_benign * prescreen["benign"] and \
+            prescreen["risky"] - missed >= args.prescreen_min_risky * prescreen["risky"]
+        print(f"{'✅' if prescreen_ok else '❌'} Pre-screen samples: {prescreen['risky'] - missed}/{prescreen['risky']} "
+              f"risky clauses flagged, {flagged}/{prescreen['benign']} benign clauses flagged")
+        for text in prescreen["risky_missed"]:
+            print(f"   missed: {text}")
+        if args.prescreen_only:
+            return 0 if prescreen_ok else 1
+
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    if args.baseline and not os.path.exists(args.baseline):
+        parser.error(f"baseline {args.baseline} not found (create one with --save-baseline)")
+    proc, base_url = start_stub(args.latency, args.dim)
+    try:
+        with tempfile.TemporaryDirectory(prefix="toscheck-bench-") as workdir:
+            # cold runs only: persistent caches would turn every stage after the first into lookups
+            os.environ.update({
+                "OPENAI_BASE_URL": base_url,
+                "OPENAI_API_KEY": "bench",
+                "TOSCHECK_CACHE_DIR": os.path.join(workdir, "cache"),
+                "EMB_CACHE": "0",
+                "GEN_CACHE": "0",
+                "EXTRACT_CACHE": "0",
+            })
+            print(f"🏁 Benchmarking sizes {sizes} (stub latency {args.latency * 1000:.0f} ms, dim {args.dim})")
+            tracemalloc.start()
+            try:
+                results = run(sizes, workdir, args.queries, args.concurrency, args.emb_batch,
+                              args.emb_concurrency, args.dtype, quiet=not args.verbose)
+            finally:
+                tracemalloc.stop()
+    finally:
+        proc.terminate()
+
+    payload = {
+        "generated_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "config": {k: v for k, v in vars(args).items() if k not in ("out", "baseline", "save_baseline", "verbose")},
+        "environment": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "startup": startup,
+        "chunker": chunker,
+        "prescreen": prescreen,
+        "results": results,
+    }
+    for path in filter(None, (args.out, args.save_baseline)):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(payload, f, indent=2)
+    print(f"✅ Wrote: {', '.join(filter(None, (args.out, args.save_baseline)))}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance, args.min_seconds)
+        if regressions:
+            print(f"❌ {len(regressions)} regression(s) vs {args.baseline}:")
+            for line in regressions:
+                print(f"   - {line}")
+            return 1
+        print(f"✅ No regressions vs {args.baseline} (tolerance {args.tolerance:.0%})")
+    return 0 if startup_ok and chunker_ok and prescreen_ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,141 @@
+# toscheck/cache.py
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import threading
+
+CACHE_DIR = os.environ.get("TOSCHECK_CACHE_DIR", ".toscheck_cache")
+
+
+class DiskCache:
+    """
+    Small persistent key -> bytes store with size-bounded LRU eviction.
+    Backed by a single SQLite file so it survives between CLI runs and is
+    safe to share across threads.
+    """
+
+    def __init__(self, path: str, max_bytes: int):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, atime REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS entries_atime ON entries(atime)")
+
+    def get_many(self, keys: list[str]) -> dict[str, bytes]:
+        found = {}
+        with self._lock:
+            for i in range(0, len(keys), 500):
+                part = keys[i:i + 500]
+                marks = ",".join("?" * len(part))
+                rows = self._db.execute(f"SELECT key, value FROM entries WHERE key IN ({marks})", part)
+                found.update(rows.fetchall())
+            if found:
+                now = time.time()
+                self._db.executemany("UPDATE entries SET atime=? WHERE key=?", [(now, k) for k in found])
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def contains_many(self, keys: list[str]) -> set[str]:
+        """Which keys are present, without loading values or touching counters/recency."""
+        found = set()
+        with self._lock:
+            for i in range(0, len(keys), 500):
+                part = keys[i:i + 500]
+                marks = ",".join("?" * len(part))
+                found.update(k for (k,) in self._db.execute(f"SELECT key FROM entries WHERE key IN ({marks})", part))
+        return found
+
+    def get(self, key: str) -> bytes | None:
+        return self.get_many([key]).get(key)
+
+    def put_many(self, items: dict[str, bytes]):
+        if not items:
+            return
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN")
+            self._db.executemany(
+                "INSERT OR REPLACE INTO entries(key, value, size, atime) VALUES (?, ?, ?, ?)",
+                [(k, v, len(v), now) for k, v in items.items()],
+            )
+            self._db.execute("COMMIT")
+            self._evict()
+
+    def put(self, key: str, value: bytes):
+        self.put_many({key: value})
+
+    def _evict(self):
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # drop least recently used entries until we are back under the bound
+        excess = total - self.max_bytes
+        freed = 0
+        victims = []
+        for key, size in self._db.execute("SELECT key, size FROM entries ORDER BY atime ASC"):
+            victims.append((key,))
+            freed += size
+            if freed >= excess:
+                break
+        self._db.executemany("DELETE FROM entries WHERE key=?", victims)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+def _normalize_text(text: str) -> str:
+    return re.sub(r"\s+", " ", text).strip()
+
+
+class EmbeddingCache(DiskCache):
+    """Content-addressed embedding store: key = sha256(model, normalized text)."""
+
+    @staticmethod
+    def key(model: str, text: str) -> str:
+        return hashlib.sha256(f"{model}\x00{_normalize_text(text)}".encode("utf-8")).hexdigest()
+
+
+_caches: dict = {}
+_init_lock = threading.Lock()
+
+
+def _get_cache(name: str, cls, flag_env: str, max_env: str, default_mb: str):
+    """Process-wide cache `name`, or None when disabled with <flag_env>=0."""
+    if os.environ.get(flag_env, "1") == "0":
+        return None
+    with _init_lock:
+        if name not in _caches:
+            max_mb = float(os.environ.get(max_env, default_mb))
+            _caches[name] = cls(os.path.join(CACHE_DIR, f"{name}.sqlite"), int(max_mb * 1024 * 1024))
+    return _caches[name]
+
+
+def get_embedding_cache() -> EmbeddingCache | None:
+    """Process-wide embedding cache, or None when disabled with EMB_CACHE=0."""
+    return _get_cache("embeddings", EmbeddingCache, "EMB_CACHE", "EMB_CACHE_MAX_MB", "256")
+
+
+def get_extract_cache() -> DiskCache | None:
+    """Extracted-text cache (see extract.py), or None when disabled with EXTRACT_CACHE=0."""
+    return _get_cache("extract", DiskCache, "EXTRACT_CACHE", "EXTRACT_CACHE_MAX_MB", "512")
+
+
+def get_generation_cache() -> DiskCache | None:
+    """LLM response cache (see llm.generate), or None when disabled with GEN_CACHE=0."""
+    return _get_cache("generations", DiskCache, "GEN_CACHE", "GEN_CACHE_MAX_MB", "128")
@@ -1,80 +1,313 @@
 # toscheck/chunk.py
+import os
 import re
+import bisect
+from collections import deque
+from functools import lru_cache
+from itertools import chain
+from collections.abc import Callable, Iterable, Iterator
 
-def dynamic_chunk(
-    text: str,
+from toscheck import metrics
+
+_PARA_BREAK = re.compile(r"\n\s*\n")
+_SENT_SPLIT = re.compile(r"(?<=[.!?;])\s+(?=[A-Z0-9(])")
+
+
+def iter_paragraphs(text: str) -> Iterator[str]:
+    """Non-empty, stripped paragraphs (split on blank lines), lazily."""
+    pos = 0
+    for m in _PARA_BREAK.finditer(text):
+        p = text[pos:m.start()].strip()
+        if p:
+            yield p
+        pos = m.end()
+    p = text[pos:].strip()
+    if p:
+        yield p
+
+
+def get_tokenizer(spec: str | None = None) -> Callable[[str], int] | None:
+    """
+    Token counter for one word, from a spec string (default env CHUNK_TOKENIZER):
+      - "words" / empty: None, i.e. the word-count proxy
+      - "tiktoken:<encoding>", e.g. "tiktoken:cl100k_base"
+      - "hf:<model>", a Hugging Face `tokenizers` tokenizer, e.g. "hf:bert-base-uncased"
+        (the tokenizer nomic-embed-text uses)
+    """
+    spec = spec if spec is not None else os.environ.get("CHUNK_TOKENIZER", "words")
+    return _load_tokenizer(spec.strip())
+
+
+@lru_cache(maxsize=None)
+def _load_tokenizer(spec: str) -> Callable[[str], int] | None:
+    kind, _, name = spec.partition(":")
+    if kind in ("", "words"):
+        return None
+    # lazy imports: both are optional dependencies
+    if kind == "tiktoken":
+        try:
+            import tiktoken
+        except ImportError as e:
+            raise ImportError("tokenizer 'tiktoken:…' needs `pip install tiktoken`") from e
+        enc = tiktoken.get_encoding(name or "cl100k_base")
+        count = lambda w: len(enc.encode_ordinary(" " + w))
+    elif kind == "hf":
+        try:
+            from tokenizers import Tokenizer
+        except ImportError as e:
+            raise ImportError("tokenizer 'hf:…' needs `pip install tokenizers`") from e
+        tok = Tokenizer.from_pretrained(name or "bert-base-uncased")
+        count = lambda w: len(tok.encode(w, add_special_tokens=False).ids)
+    else:
+        raise ValueError(f"Unknown tokenizer {spec!r} (use words, tiktoken:<encoding> or hf:<model>)")
+    # words repeat a lot, so count each distinct one once
+    return lru_cache(maxsize=1 << 16)(count)
+
+
+def _render(segs: list[str]) -> str:
+    return " ".join(s for s in segs if s)
+
+
+def iter_dynamic_chunk(
+    paras: Iterable[str],
     max_tokens: int = 200,
     soft_min_tokens: int = 80,
     overlap: int = 40,
-) -> list[str]:
+    count_tokens: Callable[[str], int] | None = None,
+) -> Iterator[str]:
     """
-    Dynamic, clause-aware chunking:
-      - Prefer natural boundaries: blank lines, headings, sentence ends, semicolons
-      - Avoid tiny chunks (use soft_min_tokens to merge short paragraphs)
-      - Provide token overlap to preserve context
+    Streaming core of dynamic_chunk: consumes paragraphs one at a time and
+    yields chunks as soon as they can no longer change. Only the last two
+    pieces are held back, since merging only ever touches those.
+
+    Every sentence is counted once; pieces are kept as lists of sentence
+    strings with a running token total, and a chunk's text is only joined
+    when it is released. `count_tokens` (see get_tokenizer) counts one
+    word; without it each word is one token.
     """
-    # First split on blank lines to respect paragraphs/sections
-    paras = [p.strip() for p in re.split(r"\n\s*\n", text) if p.strip()]
-    out = []
-    buf = []
-
-    def tokens(s: str) -> int:
-        # crude token proxy (word count)
-        return len(s.split())
-
-    def flush(force=False):
-        nonlocal buf
-        if not buf:
-            return
-        joined = " ".join(buf).strip()
-        if joined:
-            out.append(joined)
-        buf = []
+    out = deque()   # (segments, n_tokens) pieces that may still be merged
+    last = None     # last chunk released, for the consecutive-dupe filter
+
+    def release():
+        nonlocal last
+        while len(out) > 2:
+            c = _render(out.popleft()[0])
+            if c and c != last:
+                yield c
+            last = c
+
+    def tail_of(head: list[str], own: list[str]) -> tuple[list[str], int]:
+        """The last `overlap` tokens of a piece's words (head + own sentences), and their count."""
+        if count_tokens is None:
+            if overlap <= 0:
+                tail = (head + [w for s in own for w in s.split()])[-overlap:]
+                return tail, len(tail)
+            # only the sentences at the end of the piece are split
+            parts, need = [], overlap
+            for s in reversed(own):
+                ws = s.split()
+                parts.append(ws)
+                need -= len(ws)
+                if need <= 0:
+                    break
+            tail = [w for ws in reversed(parts) for w in ws]
+            tail = (head + tail if need > 0 else tail)[-overlap:]
+            return tail, len(tail)
+        ws = head + [w for s in own for w in s.split()]
+        k, n = len(ws), 0
+        while k and n + count_tokens(ws[k - 1]) <= overlap:
+            k -= 1
+            n += count_tokens(ws[k])
+        return ws[k:], n
 
     for p in paras:
         # If paragraph is very long, split by sentences and semicolons
-        parts = re.split(r"(?<=[.!?;])\s+(?=[A-Z0-9(])", p)
-        cur = []
+        sents = _SENT_SPLIT.split(p.strip())
+        if count_tokens is None:
+            counts = [len(x.split()) for x in sents]
+        else:
+            counts = [sum(count_tokens(w) for w in x.split()) for x in sents]
+
+        cur = []        # segments of the piece being built
         cur_tok = 0
-        for s in parts:
-            s_tok = tokens(s)
+        head = []       # overlap words carried over from the previous piece
+        body = 0        # index of the piece's first own sentence
+        for i, s_tok in enumerate(counts):
             if cur_tok + s_tok > max_tokens and cur_tok >= soft_min_tokens:
                 # finalize this piece
-                piece = " ".join(cur).strip()
-                if piece:
-                    out.append(piece)
+                if any(cur):
+                    out.append((cur, cur_tok))
+                    yield from release()
                 # apply overlap from the end
-                tail = " ".join(piece.split()[-overlap:])
-                cur = [tail, s]
-                cur_tok = tokens(tail) + s_tok
+                head, head_tok = tail_of(head, sents[body:i])
+                cur = [" ".join(head), sents[i]]
+                cur_tok = head_tok + s_tok
+                body = i
             else:
-                cur.append(s)
+                cur.append(sents[i])
                 cur_tok += s_tok
-        if cur:
-            piece = " ".join(cur).strip()
-            # if piece is tiny, try to merge into the buffer
-            if tokens(piece) < soft_min_tokens and out:
-                prev = out.pop()
-                merged = (prev + " " + piece).strip()
-                if tokens(merged) <= max_tokens + overlap:
-                    out.append(merged)
-                else:
-                    out.append(prev)
-                    out.append(piece)
+
+        # if piece is tiny, try to merge into the buffer
+        if cur_tok < soft_min_tokens and out:
+            prev, prev_tok = out.pop()
+            if prev_tok + cur_tok <= max_tokens + overlap:
+                out.append((prev + cur, prev_tok + cur_tok))
             else:
-                out.append(piece)
+                out.append((prev, prev_tok))
+                out.append((cur, cur_tok))
+        else:
+            out.append((cur, cur_tok))
+        yield from release()
 
     # Merge small trailing piece into previous one if needed
-    if len(out) >= 2 and tokens(out[-1]) < soft_min_tokens:
-        last = out.pop()
-        out[-1] = (out[-1] + " " + last).strip()
+    if len(out) >= 2 and out[-1][1] < soft_min_tokens:
+        tail_segs, tail_tok = out.pop()
+        prev, prev_tok = out.pop()
+        out.append((prev + tail_segs, prev_tok + tail_tok))
 
     # remove dupes/empties
-    return [c for i, c in enumerate(out) if c and (i == 0 or c != out[i-1])]
+    for segs, _ in out:
+        c = _render(segs)
+        if c and c != last:
+            yield c
+        last = c
+
+
+def dynamic_chunk(
+    text: str,
+    max_tokens: int = 200,
+    soft_min_tokens: int = 80,
+    overlap: int = 40,
+    tokenizer: str | None = None,
+) -> list[str]:
+    """
+    Dynamic, clause-aware chunking:
+      - Prefer natural boundaries: blank lines, headings, sentence ends, semicolons
+      - Avoid tiny chunks (use soft_min_tokens to merge short paragraphs)
+      - Provide token overlap to preserve context
+      - tokenizer: what a token is (see get_tokenizer); words by default
+    """
+    # First split on blank lines to respect paragraphs/sections
+    return list(iter_dynamic_chunk(iter_paragraphs(text), max_tokens, soft_min_tokens, overlap,
+                                   get_tokenizer(tokenizer)))
 
 
-def chunk_text(text: str, max_tokens: int = 500, overlap: int = 150) -> list[str]:
+def chunk_text(text: str, max_tokens: int = 500, overlap: int = 150, tokenizer: str | None = None) -> list[str]:
     """
     Backward compatible wrapper. Calls dynamic_chunk with sensible defaults.
     """
-    return dynamic_chunk(text, max_tokens=max_tokens, soft_min_tokens=max_tokens//3, overlap=overlap)
+    return dynamic_chunk(text, max_tokens=max_tokens, soft_min_tokens=max_tokens//3, overlap=overlap,
+                         tokenizer=tokenizer)
+
+
+_HEADING = re.compile(
+    r"^(?:#{1,6}\s+.+|(?:\d+(?:\.\d+)*\.?|[IVX]+\.)\s+[A-Z][^\n]{0,100}|[A-Z][A-Z0-9 ,&/()'\-]{3,100})$",
+    re.M,
+)
+
+
+def _locate(text: str, chunks: list[str]) -> list[tuple[int, int]]:
+    """
+    Char spans of each chunk in `text`. Chunks are runs of whitespace-separated
+    words from the text (re-joined with single spaces), so the text is split
+    into words once and each chunk is found as a run of those words, scanning
+    forward from the previous chunk's start (overlap means chunks can start
+    before the last one ended).
+    """
+    matches = list(re.finditer(r"\S+", text))
+    words = [m.group(0) for m in matches]
+    first_at: dict[str, list[int]] = {}
+    for j, w in enumerate(words):
+        first_at.setdefault(w, []).append(j)
+
+    spans = []
+    cursor = 0
+    for c in chunks:
+        cw = c.split()
+        found = -1
+        if cw:
+            starts = first_at.get(cw[0], [])
+            # candidates at/after the cursor first, then anywhere as a fallback
+            k = bisect.bisect_left(starts, cursor)
+            for i in chain(range(k, len(starts)), range(k)):
+                j = starts[i]
+                if words[j:j + len(cw)] == cw:
+                    found = j
+                    break
+        if found < 0:
+            spans.append((-1, -1))
+            continue
+        spans.append((matches[found].start(), matches[found + len(cw) - 1].end()))
+        cursor = found
+    return spans
+
+
+def chunk_document(
+    doc: dict,
+    max_tokens: int = 500,
+    overlap: int = 150,
+    tokenizer: str | None = None,
+) -> tuple[list[str], list[dict]]:
+    """
+    Chunk one document from extract.read_documents and return (chunks, metas),
+    where each meta records doc_id, source, char_start/char_end within the
+    document text and the nearest preceding section heading.
+    """
+    text = doc["text"]
+    chunks = chunk_text(text, max_tokens=max_tokens, overlap=overlap, tokenizer=tokenizer)
+    headings = [(m.start(), m.group(0).lstrip("#").strip()) for m in _HEADING.finditer(text)]
+    metas = []
+    h = 0
+    heading = None
+    for start, end in _locate(text, chunks):
+        # spans move forward, so walk the heading list alongside them
+        while h < len(headings) and headings[h][0] <= max(start, 0):
+            heading = headings[h][1]
+            h += 1
+        metas.append({
+            "doc_id": doc["doc_id"],
+            "source": doc["source"],
+            "char_start": start,
+            "char_end": end,
+            "heading": heading,
+        })
+    return chunks, metas
+
+
+def iter_document_chunks(
+    docs: Iterable[dict],
+    max_tokens: int = 500,
+    overlap: int = 150,
+    tokenizer: str | None = None,
+) -> Iterator[tuple[str, dict]]:
+    """
+    (chunk, meta) pairs for a stream of documents, one document in memory at
+    a time. Closing this generator closes `docs` too, so an abandoned build
+    stops its extraction.
+    """
+    try:
+        for doc in docs:
+            with metrics.span("chunk"):
+                chunks, metas = chunk_document(doc, max_tokens=max_tokens, overlap=overlap, tokenizer=tokenizer)
+            metrics.count("chunks", len(chunks))
+            if metrics.enabled():
+                metrics.count("chunk_chars", sum(len(c) for c in chunks))
+            yield from zip(chunks, metas)
+    finally:
+        close = getattr(docs, "close", None)
+        if close is not None:
+            close()
+
+
+def chunk_documents(
+    docs: list[dict],
+    max_tokens: int = 500,
+    overlap: int = 150,
+    tokenizer: str | None = None,
+) -> tuple[list[str], list[dict]]:
+    """chunk_document over several documents, concatenated in order."""
+    chunks, metas = [], []
+    for c, m in iter_document_chunks(docs, max_tokens=max_tokens, overlap=overlap, tokenizer=tokenizer):
+        chunks.append(c)
+        metas.append(m)
+    return chunks, metas
@@ -0,0 +1,26 @@
+# toscheck/clients.py
+import os
+import threading
+from dotenv import load_dotenv
+load_dotenv()
+
+_client = None
+_lock = threading.Lock()
+
+
+def get_client():
+    """
+    The process-wide OpenAI-compatible client (Ollama by default), created on
+    first use. Embeddings and chat share it, and with it one pooled HTTP
+    connection set, which matters for the long-running `serve` mode.
+    """
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                from openai import OpenAI
+                _client = OpenAI(
+                    base_url=os.environ.get("OPENAI_BASE_URL", "http://localhost:11434/v1"),
+                    api_key=os.environ.get("OPENAI_API_KEY", "ollama"),
+                )
+    return _client
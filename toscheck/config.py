@@ -0,0 +1,12 @@
+# toscheck/config.py
+# Env-driven defaults the CLI needs before any heavy module is imported
+# (index.py / ann.py re-export them). Keep this file dependency-light.
+import os
+from dotenv import load_dotenv
+load_dotenv()
+
+EMB_BATCH_SIZE = int(os.environ.get("EMB_BATCH_SIZE", "32"))
+EMB_CONCURRENCY = int(os.environ.get("EMB_CONCURRENCY", "4"))
+INDEX_DTYPE = os.environ.get("INDEX_DTYPE", "float32")
+ANN_MIN_ROWS = int(os.environ.get("ANN_MIN_ROWS", "20000"))  # below this, brute force is fast enough
+ANN_NPROBE = int(os.environ.get("ANN_NPROBE", "16"))          # lists scanned per query: recall vs latency
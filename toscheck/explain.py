@@ -1,35 +1,49 @@
 # toscheck/explain.py
+import re
 from dotenv import load_dotenv
 from collections import defaultdict
-from toscheck.index import load_index
-from toscheck.retrieve import retrieve
-from toscheck.llm import _client, GEN_MODEL
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from toscheck.index import load_index, embedding_rows
+from toscheck.retrieve import retrieve, match_many
+from toscheck.llm import generate, cached_answer, remember
+from toscheck.cache import get_generation_cache
+from toscheck import metrics
 
 load_dotenv()
 
+KB_POOL = 20  # KB candidates per clause before thresholding/diversification
+BATCH_MAX_CLAUSES = 8  # clauses per batched prompt, so each answer stays short enough to parse
+NO_MATCH_ANSWER = "No close KB match found."
+RULE_CLEAN_ANSWER = "No red-flag patterns matched by the rule pre-screen; not sent for LLM review."
+GEN_TEMPERATURE = 0.2
+
+
+def _kb_filename(hit: dict) -> str:
+    meta = hit.get("meta")
+    if meta:
+        return meta["source"]
+    # indexes built before per-chunk metadata: detect the "### FILE: <name>"
+    # marker from extract.py directory indexing, else guess by keyword
+    chunk = hit.get("chunk", "")
+    marker = "### FILE:"
+    first = chunk.splitlines()[0] if chunk else ""
+    if marker in first:
+        return first.replace(marker, "").strip()
+    for k in ("arbitration", "unilateral_changes", "refund", "content_rights", "surveillance", "data_collection"):
+        if k in chunk.lower():
+            return f"{k}.txt"
+    return "unknown"
+
 
 def _diversify_by_kb_filename(kb_hits: list[dict], max_per_file: int = 1) -> list[dict]:
     """
     Prefer variety: limit how many hits from the same KB file we keep.
-    We infer filename from a header marker inserted during directory indexing (if present),
-    falling back to chunk text heuristics.
+    The file comes from the chunk's index metadata; older indexes without
+    metadata fall back to the marker/keyword heuristics in _kb_filename.
     """
     buckets = defaultdict(list)
     for h in kb_hits:
-        chunk = h.get("chunk", "")
-        # Try to detect "### FILE: <name>" marker from extract.py directory indexing
-        fname = "unknown"
-        marker = "### FILE:"
-        if marker in chunk.splitlines()[0]:
-            # first line looks like "### FILE: X"
-            fname = chunk.splitlines()[0].replace(marker, "").strip()
-        else:
-            # crude guess by keyword
-            for k in ("arbitration", "unilateral_changes", "refund", "content_rights", "surveillance", "data_collection"):
-                if k in chunk.lower():
-                    fname = f"{k}.txt"
-                    break
-        buckets[fname].append(h)
+        buckets[_kb_filename(h)].append(h)
 
     diversified = []
     for fname, items in buckets.items():
@@ -39,6 +53,143 @@ def _diversify_by_kb_filename(kb_hits: list[dict], max_per_file: int = 1) -> lis
     return sorted(diversified, key=lambda x: x.get("score", 0.0), reverse=True)
 
 
+def _select_kb_hits(raw_kb_hits: list[dict], k_kb: int, kb_score_threshold: float) -> list[dict]:
+    # threshold + diversify by file name, then truncate to k_kb
+    filtered = [h for h in raw_kb_hits if h.get("score", 0.0) >= kb_score_threshold]
+    return _diversify_by_kb_filename(filtered, max_per_file=1)[:k_kb]
+
+
+def _kb_context(kb_hits: list[dict]) -> str:
+    return "\n\n---\n\n".join(
+        (f"[{j}] {k['chunk']}") for j, k in enumerate(kb_hits)
+    ) if kb_hits else "(no close KB matches)"
+
+
+def _clause_prompt(clause: str, kb_hits: list[dict]) -> str:
+    return f"""
+You are analyzing a Terms of Service clause using known red-flag patterns. Explain clearly what the clause means, why it matters, and cite which patterns match.
+
+Clause:
+{clause}
+
+Relevant known patterns (from a curated KB):
+{_kb_context(kb_hits)}
+
+Respond with:
+- 1–2 sentence plain-language summary
+- Bullet list of risks/implications with short quotes where possible
+- Final line: "Likely category: <category guess>"
+If nothing matches, say: "No close KB match found."
+"""
+
+
+def _batch_block(n: int, clause: str, kb_hits: list[dict]) -> str:
+    return f"""=== CLAUSE {n} ===
+Clause:
+{clause}
+
+Relevant known patterns (from a curated KB):
+{_kb_context(kb_hits)}
+"""
+
+
+def _batch_prompt(blocks: list[str]) -> str:
+    # one shared preamble for several clauses; answers come back as
+    # "### CLAUSE <n>" sections so they can be split per clause
+    body = "\n".join(blocks)
+    return f"""
+You are analyzing Terms of Service clauses using known red-flag patterns. For EACH of the {len(blocks)} numbered clauses below, explain clearly what the clause means, why it matters, and cite which patterns match.
+
+{body}
+Answer every clause, in order. Start each answer with a line "### CLAUSE <n>" (its number above), then:
+- 1–2 sentence plain-language summary
+- Bullet list of risks/implications with short quotes where possible
+- Final line: "Likely category: <category guess>"
+If nothing matches a clause, say: "No close KB match found."
+"""
+
+
+# the heading the prompt asks for ("### CLAUSE 1", maybe with a title), or the same in ** / === markup;
+# a bullet or plain sentence mentioning "Clause 2" is never a heading
+_SECTION = re.compile(r"^(?:#{1,6}|\*\*|={3,})[ \t]*CLAUSE[ \t]+(\d+)\b.*$", re.IGNORECASE | re.MULTILINE)
+
+
+def _split_batch_answer(text: str, n: int) -> dict[int, str]:
+    """
+    {clause number: answer} for the well-formed sections of a batched
+    response. Sections must come in order 1, 2, 3...; from the first
+    out-of-sequence number on (from the number itself, if it repeats) the
+    clauses count as missing and are asked again alone, rather than risk
+    caching an answer under the wrong clause.
+    """
+    marks = list(_SECTION.finditer(text))
+    out = {}
+    for i, m in enumerate(marks):
+        k = int(m.group(1))
+        if k != len(out) + 1 or k > n:
+            if k <= len(out):
+                # a repeated heading: no telling which section belongs to k, so k onwards are missing
+                out = {j: a for j, a in out.items() if j < k}
+            break
+        end = marks[i + 1].start() if i + 1 < len(marks) else len(text)
+        body = text[m.end():end].strip()
+        if not body:
+            break
+        out[k] = body
+    return out
+
+
+def _pack(prompts: list[str], sizes: dict[str, int], budget: int) -> list[list[str]]:
+    """Greedy, order-preserving batches of at most `budget` tokens (an oversized prompt goes alone)."""
+    batches, cur, used = [], [], 0
+    for p in prompts:
+        if cur and (used + sizes[p] > budget or len(cur) >= BATCH_MAX_CLAUSES):
+            batches.append(cur)
+            cur, used = [], 0
+        cur.append(p)
+        used += sizes[p]
+    if cur:
+        batches.append(cur)
+    return batches
+
+
+def _generate_safe(prompt: str, label, model: str | None, timeout: float | None, use_cache: bool) -> tuple[str, bool]:
+    """(answer, ok); one slow or failing clause should not sink the whole scan."""
+    try:
+        return generate(prompt, model=model, temperature=GEN_TEMPERATURE, timeout=timeout, use_cache=use_cache), True
+    except Exception as e:
+        print(f"⚠️  Clause {label}: generation failed ({type(e).__name__}: {e})")
+        return f"(generation failed: {type(e).__name__})", False
+
+
+def _generate_batch(batch: list[str], parts: dict, labels: dict, model, timeout, use_cache: bool) -> tuple[dict, int]:
+    """
+    ({single-clause prompt: (answer, ok)}, fallbacks) for one batch. The
+    combined response is split per clause and each answer is cached under its
+    single-clause prompt, so later runs hit regardless of how clauses were
+    grouped; a clause missing from the response is asked for on its own.
+    """
+    metrics.count("clause_batches")
+    out, fallbacks, got = {}, 0, {}
+    if len(batch) > 1:
+        prompt = _batch_prompt([_batch_block(i, *parts[p]) for i, p in enumerate(batch, 1)])
+        label = f"batch {labels[batch[0]]}..{labels[batch[-1]]}"
+        text, ok = _generate_safe(prompt, label, model, timeout, use_cache=False)
+        if ok:
+            got = _split_batch_answer(text, len(batch))
+    for i, p in enumerate(batch, 1):
+        if i in got:
+            out[p] = (got[i], True)
+        else:
+            if len(batch) > 1:
+                fallbacks += 1
+            out[p] = _generate_safe(p, labels[p], model, timeout, use_cache=False)
+        if use_cache and out[p][1]:
+            remember(p, out[p][0], model, GEN_TEMPERATURE)
+    metrics.count("clause_batch_fallbacks", fallbacks)
+    return out, fallbacks
+
+
 def explain_tos_with_kb(
     query: str,
     tos_cache: str,
@@ -47,6 +198,18 @@ def explain_tos_with_kb(
     k_kb: int = 3,
     all_chunks: bool = True,
     kb_score_threshold: float = 0.30,
+    concurrency: int = 1,
+    timeout: float | None = None,
+    model: str | None = None,
+    use_cache: bool = True,
+    batch_tokens: int = 0,
+    skip_unmatched: bool = False,
+    prescreen=None,
+    prescreen_kb_score: float | None = None,
+    resume: dict | None = None,
+    on_result=None,
+    stats: dict | None = None,
+    loader=load_index,
 ):
     """
     Explain the entire TOS (or top-k chunks) using KB patterns.
@@ -54,10 +217,30 @@ def explain_tos_with_kb(
     - all_chunks=True: iterate every TOS chunk
     - k_kb: how many KB patterns to show per clause (after diversification)
     - kb_score_threshold: drop weak KB matches
+    - concurrency: how many clauses to have in flight against the LLM at once
+    - timeout: per-request generation timeout in seconds (None = client default)
+    - model: generation model (default GEN_MODEL)
+    - use_cache: read/write the persistent generation cache
+    - batch_tokens: pack several clauses into one prompt of about this many
+      tokens (word count, like chunking); 0 = one request per clause
+    - skip_unmatched: no LLM call for clauses without KB matches (unless
+      the prescreen flags them); they get NO_MATCH_ANSWER
+    - prescreen: a rules.RuleSet; clauses it flags, or whose best KB match
+      scores at least prescreen_kb_score (default: kb_score_threshold, i.e.
+      any KB match), go to the LLM as usual, the rest get RULE_CLEAN_ANSWER.
+      Results then carry the matched rule "flags".
+    - resume: {clause_idx: result} from an interrupted run; a clause whose
+      text is unchanged reuses its result instead of being generated again
+    - on_result: called as on_result(result, ok) on this thread as soon as
+      each new clause is answered (in completion order), e.g. to stream it
+      to a report
+    - stats: if given, filled with clause/prompt/cache counters for the report
+    - loader: index loader by directory (serve passes its warm-index store)
     """
     print("🔍 Loading indexes...")
-    tos_data = load_index(out_dir=tos_cache)
-    kb_data  = load_index(out_dir=kb_cache)
+    with metrics.span("load"):
+        tos_data = loader(tos_cache)
+        kb_data  = loader(kb_cache)
 
     # choose which TOS chunks to process
     if all_chunks:
@@ -67,47 +250,137 @@ def explain_tos_with_kb(
         tos_hits = retrieve(query, tos_data, k=k_tos)
         print(f"📄 Retrieved {len(tos_hits)} relevant TOS chunks by query")
 
-    explanations = []
+    resume = resume or {}
+    results: list = [None] * len(tos_hits)
+    for i, h in enumerate(tos_hits):
+        prev = resume.get(h.get("idx"))
+        if prev is not None and prev.get("clause") == h["chunk"]:
+            results[i] = prev
+    live = [i for i, r in enumerate(results) if r is None]
 
-    for hit in tos_hits:
-        clause = hit["chunk"]
-        raw_kb_hits = retrieve(clause, kb_data, k=20)  # get a larger pool first
-        # threshold + diversify by file name, then truncate to k_kb
-        filtered = [h for h in raw_kb_hits if h.get("score", 0.0) >= kb_score_threshold]
-        kb_hits = _diversify_by_kb_filename(filtered, max_per_file=1)[:k_kb]
+    # Match every selected clause against the KB in one batched pass, reusing
+    # the stored TOS embeddings instead of re-embedding each clause.
+    Q = embedding_rows(tos_data, [tos_hits[i]["idx"] for i in live])
+    kb_pools = match_many(Q, kb_data, k=KB_POOL)  # get a larger pool first
+    kb_hits = {i: _select_kb_hits(pool, k_kb, kb_score_threshold) for i, pool in zip(live, kb_pools)}
 
-        kb_context = "\n\n---\n\n".join(
-            (f"[{j}] {k['chunk']}") for j, k in enumerate(kb_hits)
-        ) if kb_hits else "(no close KB matches)"
+    # Identical clause + KB context renders an identical prompt (boilerplate
+    # repeats a lot), so each distinct prompt is generated only once.
+    prompts = {i: _clause_prompt(tos_hits[i]["chunk"], kb_hits[i]) for i in live}
+    unique = list(dict.fromkeys(prompts.values()))
+    labels, parts, waiting = {}, {}, defaultdict(list)
+    for i, p in prompts.items():
+        labels.setdefault(p, tos_hits[i].get("idx"))
+        parts.setdefault(p, (tos_hits[i]["chunk"], kb_hits[i]))
+        waiting[p].append(i)
 
-        prompt = f"""
-You are analyzing a Terms of Service clause using known red-flag patterns. Explain clearly what the clause means, why it matters, and cite which patterns match.
+    flags = {}
+    if prescreen is not None:
+        with metrics.span("prescreen"):
+            flags = dict(zip(live, prescreen.scan(tos_hits[i]["chunk"] for i in live)))
 
-Clause:
-{clause}
+    answers = {}
 
-Relevant known patterns (from a curated KB):
-{kb_context}
+    def finish(got: dict):
+        for p, (answer, ok) in got.items():
+            answers[p] = (answer, ok)
+            for i in waiting[p]:
+                results[i] = {
+                    "clause_idx": tos_hits[i].get("idx"),
+                    "clause": tos_hits[i]["chunk"],
+                    "patterns": kb_hits[i],   # each has idx/score/chunk
+                    "answer": answer,
+                }
+                if prescreen is not None:
+                    results[i]["flags"] = flags[i]
+                if on_result is not None:
+                    on_result(results[i], ok)
 
-Respond with:
-- 1–2 sentence plain-language summary
-- Bullet list of risks/implications with short quotes where possible
-- Final line: "Likely category: <category guess>"
-If nothing matches, say: "No close KB match found."
-"""
+    if skip_unmatched:
+        # a rule flag is reason enough to ask the LLM, KB match or not
+        finish({p: (NO_MATCH_ANSWER, True) for p in unique
+                if not parts[p][1] and not flags.get(waiting[p][0])})
+    n_clean = 0
+    if prescreen is not None:
+        ambiguous = kb_score_threshold if prescreen_kb_score is None else prescreen_kb_score
+        # clause text decides both the prompt and the flags, so any waiting clause will do
+        clean = {
+            p: (RULE_CLEAN_ANSWER, True) for p in unique
+            if p not in answers and not flags[waiting[p][0]]
+            and max((k.get("score", 0.0) for k in parts[p][1]), default=0.0) < ambiguous
+        }
+        n_clean = len(clean)
+        finish(clean)
+    todo = [p for p in unique if p not in answers]
+
+    cache = get_generation_cache() if use_cache else None
+    before = cache.stats() if cache is not None else None
+
+    n_batches = fallbacks = 0
+    with metrics.span("generate"):
+        if batch_tokens > 0:
+            # cached clauses never go into a batch
+            pending = []
+            for p in todo:
+                hit = cached_answer(p, model, GEN_TEMPERATURE) if cache is not None else None
+                if hit is not None:
+                    finish({p: (hit, True)})
+                else:
+                    pending.append(p)
+            budget = batch_tokens - len(_batch_prompt([]).split())
+            sizes = {p: len(_batch_block(0, *parts[p]).split()) for p in pending}
+            batches = _pack(pending, sizes, budget)
+            n_batches = len(batches)
+
+            def work(batch):
+                return _generate_batch(batch, parts, labels, model, timeout, use_cache)
+            units = batches
+        else:
+            def work(p):
+                return {p: _generate_safe(p, labels[p], model, timeout, use_cache)}, 0
+            units = todo
+
+        if concurrency <= 1:
+            for u in units:
+                got, fb = work(u)
+                finish(got)
+                fallbacks += fb
+        else:
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                for fut in as_completed([pool.submit(work, u) for u in units]):
+                    got, fb = fut.result()
+                    finish(got)
+                    fallbacks += fb
+    skipped = len(unique) - len(todo) - n_clean
+    metrics.count("clauses", len(tos_hits))
+    metrics.count("unique_prompts", len(unique))
+    metrics.count("clauses_skipped_unmatched", skipped)
+    metrics.count("clauses_prescreened_clean", n_clean)
+
+    if stats is not None:
+        stats["clauses"] = len(tos_hits)
+        stats["unique_prompts"] = len(unique)
+        stats["generation_failures"] = sum(1 for _, ok in answers.values() if not ok)
+        stats["skipped_unmatched"] = skipped
+        if prescreen is not None:
+            stats["prescreen"] = {
+                "flagged": sum(1 for f in flags.values() if f),
+                "clean": n_clean,
+            }
+        if resume:
+            stats["resumed"] = len(tos_hits) - len(live)
+        if batch_tokens > 0:
+            stats["batches"] = n_batches
+            stats["batch_fallbacks"] = fallbacks
+        if cache is not None:
+            after = cache.stats()
+            hits = after["hits"] - before["hits"]
+            misses = after["misses"] - before["misses"]
+            stats["generation_cache"] = {
+                "hits": hits,
+                "misses": misses,
+                "hit_rate": round(hits / (hits + misses), 4) if hits + misses else 0.0,
+            }
 
-        resp = _client.chat.completions.create(
-            model=GEN_MODEL,
-            temperature=0.2,
-            messages=[{"role": "user", "content": prompt}],
-        )
-        answer = resp.choices[0].message.content.strip()
-
-        explanations.append({
-            "clause_idx": hit.get("idx"),
-            "clause": clause,
-            "patterns": kb_hits,   # each has idx/score/chunk
-            "answer": answer
-        })
-
-    return explanations
+    # results stay in tos_hits order, i.e. clause_idx order for all_chunks
+    return results
@@ -2,37 +2,337 @@
 from pathlib import Path
 import os
 import re
+import time
+import zlib
+import queue
+import signal
+import hashlib
+from collections import deque
+from collections.abc import Iterator
 
-def read_text(input_path: str | None, url: str | None) -> str:
+from toscheck import metrics
+from toscheck.cache import get_extract_cache
+
+SUPPORTED_SUFFIXES = (".txt", ".md", ".rtf", ".html", ".htm", ".pdf")
+# bump when _read_any_file/_normalize output changes, to invalidate cached text
+EXTRACTOR_VERSION = "1"
+
+
+def _doc_id(source: str) -> str:
+    # stable, filesystem-safe id derived from the document's source path/URL;
+    # when sanitizing changed anything ("a/b.txt" vs "a_b.txt"), a short hash
+    # of the original keeps ids (and shard directories) from colliding
+    slug = re.sub(r"[^A-Za-z0-9._-]+", "_", source).strip("_.") or "doc"
+    if slug == source:
+        return slug
+    return f"{slug}-{hashlib.sha256(source.encode('utf-8')).hexdigest()[:8]}"
+
+
+def _file_key(fp: Path) -> str:
+    # content hash + extractor version: renames/touches don't matter, edits do
+    with open(fp, "rb") as f:
+        digest = hashlib.file_digest(f, "sha256").hexdigest()
+    return f"file:{EXTRACTOR_VERSION}:{fp.suffix.lower()}:{digest}"
+
+
+def _cache_get(cache, key: str) -> str | None:
+    if cache is None:
+        return None
+    blob = cache.get(key)
+    return zlib.decompress(blob).decode("utf-8") if blob is not None else None
+
+
+def _cache_put(cache, key: str, text: str):
+    if cache is not None:
+        cache.put(key, zlib.compress(text.encode("utf-8"), 1))
+
+
+def _extract_file(path: str) -> str:
+    # top-level so it can run in a worker process
+    return _normalize(_read_any_file(Path(path)))
+
+
+def _extract_isolated(fp: Path) -> str | None:
+    try:
+        return _extract_file(str(fp))
+    except Exception as e:
+        print(f"⚠️  Skipping {fp}: {type(e).__name__}: {e}")
+        return None
+
+
+def _report_pid(pids):
+    # pool initializer: lets the parent kill workers without executor internals
+    pids.put(os.getpid())
+
+
+class _ExtractPool:
+    """
+    Process pool for _extract_file whose workers can be killed: a worker
+    stuck in pdfminer won't notice a cancel, so replacing the pool is the
+    only way to stop it.
+    """
+
+    def __init__(self, workers: int):
+        # imported here: process pools are only needed for parallel extraction
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        self._pids = multiprocessing.Queue()
+        self._executor = ProcessPoolExecutor(max_workers=workers, initializer=_report_pid, initargs=(self._pids,))
+        self._workers = workers
+
+    def submit(self, fp: Path):
+        return self._executor.submit(_extract_file, str(fp))
+
+    def kill(self):
+        while True:
+            try:
+                pid = self._pids.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass   # already gone
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._pids.close()
+
+    def replace(self) -> "_ExtractPool":
+        self.kill()
+        return _ExtractPool(self._workers)
+
+
+_SUSPECT = "suspect"       # taken down by a crash: rerun alone to find the culprit
+_TIMED_OUT = "timed out"   # ran past its budget while the pool was being drained
+
+
+def _extract_parallel(files: list[Path], workers: int, timeout: float | None) -> Iterator[tuple[Path, str | None]]:
+    """
+    Extract files on a process pool, yielding (path, text) in input order;
+    text is None for files that failed or ran past `timeout` seconds. At
+    most `workers` files are in flight, so a file starts running when it is
+    submitted and its timeout counts from then. A stuck file only costs
+    itself: the other in-flight files finish first, then the pool is
+    replaced. The files a crashed worker took down are rerun one at a time,
+    so the one that crashes alone is skipped and the rest run once more.
+    """
+    from concurrent.futures import Future, wait, TimeoutError as FuturesTimeout
+    from concurrent.futures.process import BrokenProcessPool
+    pool = _ExtractPool(workers)
+    inflight: deque = deque()   # [path, future | _SUSPECT | _TIMED_OUT, deadline, ran alone] in input order
+    todo = deque(files)
+
+    def start(entry, alone=False):
+        entry[1:] = [pool.submit(entry[0]), None if timeout is None else time.monotonic() + timeout, alone]
+
+    def remaining(deadline):
+        return None if deadline is None else max(0.0, deadline - time.monotonic())
+
+    try:
+        while True:
+            suspects = [e for e in inflight if e[1] is _SUSPECT]
+            if suspects:
+                if not any(isinstance(e[1], Future) and not e[1].done() for e in inflight):
+                    start(suspects[0], alone=True)
+            else:
+                while todo and len(inflight) < workers:
+                    entry = [todo.popleft(), None, None, False]
+                    start(entry)
+                    inflight.append(entry)
+            if not inflight:
+                return
+            fp, fut, deadline, alone = inflight[0]
+            if fut is _TIMED_OUT:
+                inflight.popleft()
+                print(f"⚠️  Skipping {fp}: extraction exceeded {timeout:g}s")
+                yield fp, None
+                continue
+            try:
+                text = fut.result(timeout=remaining(deadline))
+            except FuturesTimeout:
+                inflight.popleft()
+                print(f"⚠️  Skipping {fp}: extraction exceeded {timeout:g}s")
+                # killing the stuck worker takes the pool down, so let the
+                # other in-flight files finish within their own budgets first
+                for entry in inflight:
+                    if isinstance(entry[1], Future) and not wait([entry[1]], timeout=remaining(entry[2])).done:
+                        entry[1] = _TIMED_OUT
+                pool = pool.replace()
+                yield fp, None
+                continue
+            except BrokenProcessPool:
+                if alone:
+                    inflight.popleft()
+                    print(f"⚠️  Skipping {fp}: extraction worker crashed")
+                    pool = pool.replace()
+                    yield fp, None
+                    continue
+                # any in-flight file may have killed the pool
+                for entry in inflight:
+                    f = entry[1]
+                    if isinstance(f, Future) and (not f.done() or isinstance(f.exception(), BrokenProcessPool)):
+                        entry[1] = _SUSPECT
+                pool = pool.replace()
+                continue
+            except Exception as e:
+                inflight.popleft()
+                print(f"⚠️  Skipping {fp}: {type(e).__name__}: {e}")
+                yield fp, None
+                continue
+            inflight.popleft()
+            yield fp, text
+    finally:
+        pool.kill()
+
+
+def iter_documents(
+    input_path: str | None,
+    url: str | None,
+    workers: int = 1,
+    timeout: float | None = None,
+) -> Iterator[dict]:
+    """
+    Yield one {"doc_id", "source", "text"} dict per file (or per URL), text
+    normalized. Files are extracted lazily, so a directory of any size only
+    holds a few documents' text in memory at once.
+
+    For directories, workers > 1 (or a per-file `timeout`) extracts files on
+    a process pool; output order stays sorted by path either way. A file that
+    fails to extract is reported and skipped instead of aborting the run.
+    """
     if url:
-        # lazy import to avoid lxml build unless needed
-        from trafilatura import extract as trafi_extract, fetch_url
-        doc = fetch_url(url)
-        txt = trafi_extract(doc) or ""
-        return _normalize(txt)
+        with metrics.span("extract"):
+            txt = _read_url(url)
+        _record(txt)
+        yield {"doc_id": _doc_id(url), "source": url, "text": txt}
+        return
 
     if input_path:
         p = Path(input_path)
 
-        # ---- NEW: directory ingestion ----
+        # ---- directory ingestion: one document per supported file ----
         if p.is_dir():
-            parts: list[str] = []
-            for fp in sorted(p.rglob("*")):
-                if not fp.is_file():
-                    continue
-                suf = fp.suffix.lower()
-                if suf in (".txt", ".md", ".rtf", ".html", ".htm", ".pdf"):
-                    txt = _read_any_file(fp)
-                    if txt.strip():
-                        parts.append(f"\n\n### FILE: {fp.name}\n\n{txt}")
-            return _normalize("\n\n".join(parts))
+            files = [fp for fp in sorted(p.rglob("*")) if fp.is_file() and fp.suffix.lower() in SUPPORTED_SUFFIXES]
+            cache = get_extract_cache()
+            keys = {fp: _file_key(fp) for fp in files} if cache is not None else {}
+            hits = cache.contains_many(list(keys.values())) if cache is not None else set()
+            misses = [fp for fp in files if keys.get(fp) not in hits]
+            if workers > 1 or timeout:
+                extracted = _extract_parallel(misses, max(1, workers), timeout)
+            else:
+                extracted = ((fp, _extract_isolated(fp)) for fp in misses)
+            # misses come back in order, so merge them with the (lazily read) hits
+            try:
+                for fp in files:
+                    with metrics.span("extract"):
+                        if keys.get(fp) in hits:
+                            metrics.count("extract_cache_hits")
+                            txt = _cache_get(cache, keys[fp])
+                            if txt is None:  # evicted since we checked
+                                txt = _extract_isolated(fp)
+                        else:
+                            metrics.count("extract_cache_misses")
+                            _, txt = next(extracted)
+                            if txt is not None:
+                                _cache_put(cache, keys.get(fp), txt)
+                    _record(txt, fp)
+                    if txt:
+                        source = fp.relative_to(p).as_posix()
+                        yield {"doc_id": _doc_id(source), "source": source, "text": txt}
+            finally:
+                extracted.close()   # stops the worker pool if the consumer gave up early
+            return
 
         # ---- single file path ----
-        return _normalize(_read_any_file(p))
+        with metrics.span("extract"):
+            cache = get_extract_cache()
+            key = _file_key(p) if cache is not None else None
+            txt = _cache_get(cache, key)
+            if txt is None:
+                metrics.count("extract_cache_misses")
+                txt = _extract_file(str(p))
+                _cache_put(cache, key, txt)
+            else:
+                metrics.count("extract_cache_hits")
+        _record(txt, p)
+        yield {"doc_id": _doc_id(p.name), "source": p.name, "text": txt}
+        return
 
     raise ValueError("Provide --input FILE|DIR or --url URL")
 
 
+def _record(txt: str | None, fp: Path | None = None):
+    """Document/byte counters for one extracted input."""
+    if not metrics.enabled():
+        return
+    if fp is not None:
+        metrics.count("extract_input_bytes", fp.stat().st_size)
+    if txt is None:
+        metrics.count("extract_failures")
+        return
+    metrics.count("extract_documents")
+    metrics.count("extract_chars", len(txt))
+
+
+def _url_validators(url: str) -> str | None:
+    """ETag / Last-Modified from a HEAD request, or None if the server gives neither."""
+    import urllib.request
+    try:
+        req = urllib.request.Request(url, method="HEAD", headers={"User-Agent": "toscheck"})
+        with urllib.request.urlopen(req, timeout=10) as resp:
+            etag = resp.headers.get("ETag")
+            modified = resp.headers.get("Last-Modified")
+    except Exception:
+        return None
+    if not etag and not modified:
+        return None
+    return f"{etag or ''}|{modified or ''}"
+
+
+def _read_url(url: str) -> str:
+    """
+    Fetch + extract a URL through the extraction cache. When the server sends
+    ETag/Last-Modified, an unchanged page is served without fetching at all;
+    otherwise the page is fetched and only parsing is skipped if its HTML is
+    byte-identical to a previous fetch.
+    """
+    cache = get_extract_cache()
+    fresh_key = None
+    if cache is not None:
+        validators = _url_validators(url)
+        if validators:
+            fresh_key = f"url:{EXTRACTOR_VERSION}:{hashlib.sha256(f'{url}|{validators}'.encode()).hexdigest()}"
+            txt = _cache_get(cache, fresh_key)
+            if txt is not None:
+                return txt
+
+    # lazy import to avoid lxml build unless needed
+    from trafilatura import extract as trafi_extract, fetch_url
+    doc = fetch_url(url)
+    if not doc:
+        return ""  # failed fetch: nothing worth caching
+    body_key = f"html:{EXTRACTOR_VERSION}:{hashlib.sha256(doc.encode('utf-8')).hexdigest()}"
+    txt = _cache_get(cache, body_key)
+    if txt is None:
+        txt = _normalize(trafi_extract(doc) or "")
+        _cache_put(cache, body_key, txt)
+    if fresh_key:
+        _cache_put(cache, fresh_key, txt)
+    return txt
+
+
+def read_documents(input_path: str | None, url: str | None, workers: int = 1, timeout: float | None = None) -> list[dict]:
+    """Like read_text, but keeps documents apart (see iter_documents)."""
+    return list(iter_documents(input_path, url, workers=workers, timeout=timeout))
+
+
+def read_text(input_path: str | None, url: str | None, workers: int = 1, timeout: float | None = None) -> str:
+    docs = read_documents(input_path, url, workers=workers, timeout=timeout)
+    if input_path and Path(input_path).is_dir():
+        # directories are concatenated with a marker line per file
+        return _normalize("\n\n".join(f"\n\n### FILE: {Path(d['source']).name}\n\n{d['text']}" for d in docs))
+    return docs[0]["text"] if docs else ""
+
+
 def _read_any_file(p: Path) -> str:
     suf = p.suffix.lower()
     if suf == ".pdf":
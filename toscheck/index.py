@@ -1,37 +1,811 @@
-import os, json, math
+import os, json, math, mmap, time, queue, shutil, hashlib, threading
 import numpy as np
-from tqdm import tqdm
+from collections.abc import Iterable, Iterator, Sequence
+from contextlib import ExitStack, closing
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
+from toscheck import metrics
+from toscheck.cache import get_embedding_cache
+from toscheck.ann import ANN_MIN_ROWS, build_ivf, save_ivf, remove_ivf, load_ivf
+from toscheck.lexical import BM25Builder, build_bm25, save_bm25, load_bm25
+from toscheck.clients import get_client
+from toscheck.config import EMB_BATCH_SIZE, EMB_CONCURRENCY, INDEX_DTYPE
 load_dotenv()
 
-from openai import OpenAI
-_client = OpenAI(
-    base_url=os.environ.get("OPENAI_BASE_URL", "http://localhost:11434/v1"),
-    api_key=os.environ.get("OPENAI_API_KEY", "ollama"),
-)
 EMB_MODEL = os.environ.get("OLLAMA_EMB_MODEL", "nomic-embed-text")
+EMB_RETRIES = int(os.environ.get("EMB_RETRIES", "3"))
+INDEX_FORMAT = 2
+PREFETCH_JOIN_TIMEOUT = 5.0   # seconds to wait for the prefetch thread after a failed build
+
+# None = not probed yet; False once the endpoint has definitely rejected list input
+# (a 400/422, or fewer vectors back than inputs sent), never on a transient error
+_multi_input_ok = None
+
+
+class _NoBar:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def update(self, n=1):
+        pass
+
+
+def _progress(enabled: bool, **kwargs):
+    """A tqdm bar, or a no-op stand-in (without importing tqdm) when disabled."""
+    if not enabled:
+        return _NoBar()
+    from tqdm import tqdm
+    return tqdm(**kwargs)
+
+
+def _is_client_error(e: Exception) -> bool:
+    # 4xx other than timeout / rate limit (bad model name, auth, bad input): retrying can't help,
+    # and the OpenAI client has already retried what it considers transient
+    status = getattr(e, "status_code", None)
+    return status is not None and 400 <= status < 500 and status not in (408, 429)
+
+
+def _with_retries(fn, retries: int = EMB_RETRIES, backoff: float = 0.5, give_up=_is_client_error):
+    """Call fn, retrying with exponential backoff; errors for which give_up(e) is true are raised at once."""
+    for attempt in range(retries + 1):
+        try:
+            return fn()
+        except Exception as e:
+            if attempt == retries or give_up(e):
+                raise
+            metrics.count("embedding_retries")
+            time.sleep(backoff * (2 ** attempt))
+
+
+def _create_embeddings(inp):
+    """One embeddings request, with latency/volume metrics."""
+    t0 = time.perf_counter()
+    try:
+        resp = get_client().embeddings.create(model=EMB_MODEL, input=inp)
+    except Exception:
+        metrics.count("embedding_errors")
+        raise
+    if metrics.enabled():
+        texts = inp if isinstance(inp, list) else [inp]
+        metrics.observe("embedding_request_seconds", time.perf_counter() - t0)
+        metrics.count("embedding_requests")
+        metrics.count("embedding_inputs", len(texts))
+        metrics.count("embedding_input_chars", sum(len(t) for t in texts))
+        usage = getattr(resp, "usage", None)
+        if usage is not None and usage.prompt_tokens:
+            metrics.count("embedding_tokens", usage.prompt_tokens)
+    return resp
+
+
+def _embed_one(t: str) -> list[float]:
+    resp = _with_retries(lambda: _create_embeddings(t))
+    return resp.data[0].embedding
+
+
+def _rejects_request(e: Exception) -> bool:
+    # 400/422 to a list request may just mean the endpoint takes single inputs only;
+    # other client errors (wrong model, auth) are about every request and are raised
+    return getattr(e, "status_code", None) in (400, 422)
+
+
+def _embed_many(batch: list[str]) -> list[list[float]]:
+    """
+    One request for the whole batch when the endpoint accepts list input,
+    otherwise one request per text. Order always matches `batch`.
+    """
+    global _multi_input_ok
+    if _multi_input_ok is not False and len(batch) > 1:
+        try:
+            # transient failures (timeouts, resets, 408/429/5xx) are retried, never taken as "no list input"
+            resp = _with_retries(lambda: _create_embeddings(batch))
+        except Exception as e:
+            if not _rejects_request(e):
+                raise
+            if _multi_input_ok is None:
+                _multi_input_ok = False
+            # after list input has worked, a 400 is about this batch's texts: per-text requests pin it down
+        else:
+            data = sorted(resp.data, key=lambda d: d.index)
+            if len(data) == len(batch):
+                _multi_input_ok = True
+                return [d.embedding for d in data]
+            _multi_input_ok = False   # one vector back for a list: the endpoint only embeds single inputs
+    return [_embed_one(t) for t in batch]
+
+
+def _embed_batch(
+    texts: list[str],
+    batch_size: int = EMB_BATCH_SIZE,
+    concurrency: int = EMB_CONCURRENCY,
+    verbose: bool = True,
+) -> np.ndarray:
+    """
+    Embed texts in batches of `batch_size`, with up to `concurrency` requests
+    in flight. Texts already in the embedding cache are not sent again.
+    Rows come back in input order, L2-normalized. verbose=False silences the
+    progress bar and summary lines (for callers that report their own).
+    """
+    if not texts:
+        return np.zeros((0, 0), dtype=np.float32)
+
+    cache = get_embedding_cache()
+    rows: list = [None] * len(texts)
+    if cache is not None:
+        keys = [cache.key(EMB_MODEL, t) for t in texts]
+        found = cache.get_many(list(dict.fromkeys(keys)))
+        for i, key in enumerate(keys):
+            if key in found:
+                rows[i] = np.frombuffer(found[key], dtype=np.float32)
+    todo = [i for i, r in enumerate(rows) if r is None]
+
+    if todo:
+        batch_size = max(1, batch_size)
+        pending = [texts[i] for i in todo]
+        batches = [pending[i:i + batch_size] for i in range(0, len(pending), batch_size)]
+        t0 = time.perf_counter()
+        out = []
+        with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool, \
+                _progress(verbose and len(pending) >= 2, total=len(pending), desc=f"Embedding ({EMB_MODEL})") as bar:
+            # map() yields in submission order, so output order is stable
+            for vecs in pool.map(_embed_many, batches):
+                out.extend(vecs)
+                bar.update(len(vecs))
+        elapsed = time.perf_counter() - t0
+        if verbose and len(pending) > 1:
+            print(f"⚡ Embedded {len(pending)} chunks in {elapsed:.2f}s "
+                  f"({len(pending) / max(elapsed, 1e-9):.1f} chunks/sec, batch={batch_size}, concurrency={concurrency})")
+        fresh = np.array(out, dtype=np.float32)
+        fresh /= (np.linalg.norm(fresh, axis=1, keepdims=True) + 1e-12)
+        for i, vec in zip(todo, fresh):
+            rows[i] = vec
+        if cache is not None:
+            cache.put_many({keys[i]: rows[i].tobytes() for i in todo})
+
+    if verbose and cache is not None and len(texts) > 1:
+        st = cache.stats()
+        print(f"🗃️  Embedding cache: {len(texts) - len(todo)}/{len(texts)} reused "
+              f"(session hits={st['hits']} misses={st['misses']})")
+    return np.vstack(rows).astype(np.float32, copy=False)
+
+def _chunk_hash(chunk: str) -> str:
+    return hashlib.sha256(chunk.encode("utf-8")).hexdigest()
+
+
+def _load_manifest(out_dir: str) -> dict | None:
+    path = os.path.join(out_dir, "manifest.json")
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def index_digest(out_dir: str) -> str | None:
+    """sha256 of an index's manifest (chunks, model, dtype), or None for legacy indexes without one."""
+    for name in ("manifest.json", "corpus.json"):
+        p = os.path.join(out_dir, name)
+        if os.path.exists(p):
+            with open(p, "rb") as f:
+                return hashlib.sha256(f.read()).hexdigest()
+    return None
+
+
+def _replace_atomic(path: str, write):
+    """Write via a temp file in the same directory, then os.replace into place."""
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+# what build_from_stream (and older versions of it) write into an index directory
+_INDEX_FILES = frozenset(("manifest.json", "embeddings.npy", "scales.npy", "chunks.bin", "offsets.bin",
+                          "meta.json", "chunks.json"))
+_INDEX_PREFIXES = ("bm25_", "ivf_")
+
+
+def _is_index_file(name: str) -> bool:
+    base = name[:-len(".tmp")] if name.endswith(".tmp") else name
+    return base in _INDEX_FILES or base.startswith(_INDEX_PREFIXES) or base == "vectors.f32"
+
+
+def _check_swappable(out_dir: str):
+    """
+    build_from_stream replaces out_dir as a whole, so it must not hold
+    anything but index files, and must not be (or contain) the working directory.
+    """
+    out_dir = os.path.abspath(out_dir)
+    cwd = os.getcwd()
+    if cwd == out_dir or cwd.startswith(out_dir + os.sep):
+        raise ValueError(f"Index directory {out_dir} contains the working directory; use a subdirectory such as .ragcache")
+    if not os.path.exists(out_dir):
+        return
+    if not os.path.isdir(out_dir):
+        raise ValueError(f"Index directory {out_dir} is a file")
+    other = sorted(n for n in os.listdir(out_dir) if not _is_index_file(n))
+    if other:
+        shown = ", ".join(other[:5]) + (", …" if len(other) > 5 else "")
+        raise ValueError(f"Index directory {out_dir} holds files that aren't part of an index ({shown}); "
+                         "a rebuild replaces the whole directory, so use an empty or index-only one")
+
+
+def _staging(out_dir: str) -> str:
+    return f"{os.path.abspath(out_dir)}.building"
+
+
+def _swap_in(stage: str, out_dir: str):
+    """
+    Replace out_dir with the fully written `stage` directory. Two renames:
+    if the process dies between them, _recover finishes the swap.
+    """
+    out_dir = os.path.abspath(out_dir)
+    old = f"{out_dir}.old"
+    shutil.rmtree(old, ignore_errors=True)
+    if os.path.exists(out_dir):
+        os.rename(out_dir, old)
+    os.rename(stage, out_dir)
+    shutil.rmtree(old, ignore_errors=True)
+
+
+def _recover(out_dir: str):
+    # a staged build only gets its manifest once complete, so it's safe to move in
+    out_dir = os.path.abspath(out_dir)
+    stage = _staging(out_dir)
+    if not os.path.exists(out_dir) and os.path.exists(os.path.join(stage, "manifest.json")):
+        os.rename(stage, out_dir)
+
+
+class LazyChunks(Sequence):
+    """
+    Read-only list of chunk strings backed by chunks.bin + offsets.bin.
+    Text is only decoded for the rows actually accessed.
+    """
+
+    def __init__(self, out_dir: str):
+        self._offsets = np.fromfile(os.path.join(out_dir, "offsets.bin"), dtype=np.uint64)
+        with open(os.path.join(out_dir, "chunks.bin"), "rb") as f:
+            # mmap of an empty file is not allowed
+            self._blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else b""
+
+    def __len__(self):
+        return max(len(self._offsets) - 1, 0)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        i = int(i)
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self._blob[int(self._offsets[i]):int(self._offsets[i + 1])].decode("utf-8")
+
+
+def _quantize(vecs: np.ndarray, dtype: str) -> tuple[np.ndarray, np.ndarray | None]:
+    if dtype == "float32":
+        return vecs.astype(np.float32, copy=False), None
+    if dtype == "float16":
+        return vecs.astype(np.float16), None
+    if dtype == "int8":
+        # symmetric per-row scale so each row uses the full int8 range
+        scales = (np.abs(vecs).max(axis=1) / 127.0).astype(np.float32) if len(vecs) else np.zeros(0, np.float32)
+        safe = np.where(scales > 0, scales, 1.0)[:, None]
+        q = np.clip(np.rint(vecs / safe), -127, 127).astype(np.int8)
+        return q, scales
+    raise ValueError(f"Unsupported index dtype: {dtype} (use float32, float16 or int8)")
+
+
+def embedding_rows(data: dict, rows=None) -> np.ndarray:
+    """Dequantized float32 embedding rows (all rows when `rows` is None)."""
+    M = data["embeddings"] if rows is None else data["embeddings"][rows]
+    out = np.asarray(M, dtype=np.float32)
+    scales = data.get("scales")
+    if scales is not None:
+        out = out * (scales if rows is None else scales[rows])[:, None]
+    return out
+
+
+def _prefetch(items: Iterable, maxsize: int) -> Iterator:
+    """
+    Pull `items` on a background thread into a bounded queue, so producing
+    the next items (extraction, chunking) overlaps with consuming these ones
+    (embedding). Producer exceptions are re-raised in the consumer.
+    Closing this generator (or the consumer failing) stops the producer,
+    which then closes `items` on its own thread, so upstream generators run
+    their cleanup (e.g. extraction worker processes are shut down).
+    """
+    q = queue.Queue(maxsize=maxsize)
+    done = object()
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in items:
+                if not put(item):
+                    return
+        except BaseException as e:
+            put(e)
+            return
+        finally:
+            # a generator can only be closed by the thread running it
+            close = getattr(items, "close", None)
+            if close is not None:
+                close()
+        put(done)
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        while True:
+            item = q.get()
+            if item is done:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        # it notices within one item; a file stuck in extraction is bounded by its own timeout
+        producer.join(timeout=PREFETCH_JOIN_TIMEOUT)
+
+
+def _windows(items: Iterable, size: int) -> Iterator[list]:
+    window = []
+    for item in items:
+        window.append(item)
+        if len(window) >= size:
+            yield window
+            window = []
+    if window:
+        yield window
+
+
+def build_from_stream(
+    items: Iterable[tuple[str, dict | None]],
+    out_dir: str = ".ragcache",
+    batch_size: int = EMB_BATCH_SIZE,
+    concurrency: int = EMB_CONCURRENCY,
+    dtype: str = INDEX_DTYPE,
+    ann: bool | None = None,
+    with_meta: bool = False,
+    lexical: bool = True,
+) -> dict:
+    """
+    Build (or incrementally update) the index in out_dir from a stream of
+    (chunk, meta) pairs, holding only one embedding window in memory.
+
+    The stream is consumed on a background thread, so upstream extraction
+    and chunking keep running while a window is being embedded. Chunk text,
+    offsets, meta and raw vectors are appended to temp files as windows
+    complete. Everything is written into a sibling staging directory that
+    replaces out_dir only once complete (see _swap_in), so a crashed build
+    never leaves a manifest next to data it doesn't describe. out_dir
+    belongs to the index: if it holds anything else, ValueError is raised
+    before any work is done (see _check_swappable).
+
+    A manifest of per-chunk hashes is kept next to the embeddings; chunks
+    whose hash is already in the existing index reuse their stored vector,
+    only new/changed chunks are embedded, and removed ones are dropped.
+    Vectors are stored as `dtype` (float32, float16 or int8 + per-row scale);
+    chunk text goes into one UTF-8 blob with a uint64 offsets table.
+    ann=None builds an IVF index when there are at least ANN_MIN_ROWS chunks;
+    True/False forces it on/off. With with_meta, the per-chunk meta dicts
+    (see chunk.chunk_document) are stored as meta.json. With lexical, a BM25
+    index over the chunk text is written too (see lexical.py).
+    Returns {"reused", "added", "removed"} counts.
+    """
+    _recover(out_dir)
+    _check_swappable(out_dir)
+    stage = _staging(out_dir)
+    shutil.rmtree(stage, ignore_errors=True)   # left over from a build that died mid-way
+    os.makedirs(stage)
+    path = lambda name: os.path.join(stage, name)
+
+    old = None
+    old_row = {}
+    old_hashes = []
+    manifest = _load_manifest(out_dir)
+    if manifest and manifest.get("model") == EMB_MODEL:
+        try:
+            old = load_index(out_dir)
+            old_hashes = manifest.get("hashes", [])
+            if len(old_hashes) == len(old["embeddings"]):
+                old_row = {h: i for i, h in enumerate(old_hashes)}
+            else:
+                old_hashes = []
+        except (OSError, ValueError):
+            old_hashes = []
+
+    hashes = []
+    added = 0
+    dim = 0
+    window = max(1, batch_size) * max(1, concurrency)
+    bm25 = BM25Builder() if lexical else None
+    t0 = time.perf_counter()
+    with ExitStack() as stack:
+        fv = stack.enter_context(open(path("vectors.f32.tmp"), "wb"))
+        fc = stack.enter_context(open(path("chunks.bin.tmp"), "wb"))
+        fo = stack.enter_context(open(path("offsets.bin.tmp"), "wb"))
+        fm = stack.enter_context(open(path("meta.json.tmp"), "w")) if with_meta else None
+        bar = stack.enter_context(_progress(True, desc=f"Indexing ({EMB_MODEL})", unit="chunk"))
+        pos = 0
+        fo.write(np.uint64(0).tobytes())
+        if fm:
+            fm.write("[")
+        feed = stack.enter_context(closing(_prefetch(items, maxsize=2 * window)))
+        for win in _windows(feed, window):
+            chunks = [c for c, _ in win]
+            win_hashes = [_chunk_hash(c) for c in chunks]
+            reuse = [i for i, h in enumerate(win_hashes) if h in old_row]
+            todo = [i for i, h in enumerate(win_hashes) if h not in old_row]
+            parts = {}
+            if reuse:
+                parts.update(zip(reuse, embedding_rows(old, [old_row[win_hashes[i]] for i in reuse])))
+            if todo:
+                with metrics.span("embed"):
+                    fresh = _embed_batch([chunks[i] for i in todo], batch_size=batch_size,
+                                         concurrency=concurrency, verbose=False)
+                parts.update(zip(todo, fresh))
+                added += len(todo)
+            vecs = np.vstack([parts[i] for i in range(len(win))]).astype(np.float32, copy=False)
+            dim = vecs.shape[1]
+            fv.write(vecs.tobytes())
+
+            if bm25 is not None:
+                with metrics.span("lexical_build"):
+                    for c in chunks:
+                        bm25.add(c)
+            encoded = [c.encode("utf-8") for c in chunks]
+            fc.writelines(encoded)
+            ends = pos + np.cumsum([len(b) for b in encoded], dtype=np.uint64)
+            fo.write(ends.astype(np.uint64).tobytes())
+            pos = int(ends[-1])
+            if fm:
+                fm.write(("," if hashes else "") + ",".join(json.dumps(m) for _, m in win))
+            hashes.extend(win_hashes)
+            bar.update(len(win))
+        if fm:
+            fm.write("]")
+    elapsed = time.perf_counter() - t0
+    if added > 1:
+        print(f"⚡ Embedded {added} chunks in {elapsed:.2f}s "
+              f"({added / max(elapsed, 1e-9):.1f} chunks/sec, batch={batch_size}, concurrency={concurrency})")
+    n = len(hashes)
+    metrics.count("index_chunks_added", added)
+    metrics.count("index_chunks_reused", n - added)
+    metrics.count("index_chunk_bytes", pos)
+
+    with metrics.span("index_write"):
+        _finalize(stage, n, dim, dtype, ann, with_meta, bm25)
+        # manifest goes last: _recover takes a staging directory with one as complete
+        _replace_atomic(
+            path("manifest.json"),
+            lambda f: f.write(json.dumps({
+                "format": INDEX_FORMAT, "model": EMB_MODEL, "dtype": dtype, "hashes": hashes,
+            }).encode("utf-8")),
+        )
+        old = None   # release the old index's memory maps before its directory goes away
+        _swap_in(stage, out_dir)
+
+    new_set = set(hashes)
+    return {
+        "reused": n - added,
+        "added": added,
+        "removed": sum(1 for h in set(old_hashes) if h not in new_set),
+    }
+
+
+def _finalize(out_dir: str, n: int, dim: int, dtype: str, ann: bool | None, with_meta: bool,
+              bm25: BM25Builder | None):
+    """
+    Turn build_from_stream's temp files in the staging directory into the
+    final index files (and the IVF / BM25 indexes if wanted).
+    """
+    path = lambda name: os.path.join(out_dir, name)
+    # raw float32 rows -> final (possibly quantized) .npy, one block at a time
+    raw = np.memmap(path("vectors.f32.tmp"), dtype=np.float32, mode="r", shape=(n, dim)) if n else \
+        np.zeros((0, 0), dtype=np.float32)
+    probe, probe_scales = _quantize(raw[:0], dtype)
+    stored = np.lib.format.open_memmap(path("embeddings.npy.tmp"), mode="w+", dtype=probe.dtype, shape=raw.shape)
+    scales = np.empty(n, dtype=np.float32) if probe_scales is not None else None
+    for start in range(0, n, 65536):
+        q, sc = _quantize(np.asarray(raw[start:start + 65536]), dtype)
+        stored[start:start + len(q)] = q
+        if scales is not None:
+            scales[start:start + len(q)] = sc
+    stored.flush()
+    del stored
+
+    os.replace(path("embeddings.npy.tmp"), path("embeddings.npy"))
+    if scales is not None:
+        _replace_atomic(path("scales.npy"), lambda f: np.save(f, scales))
+    os.replace(path("chunks.bin.tmp"), path("chunks.bin"))
+    os.replace(path("offsets.bin.tmp"), path("offsets.bin"))
+    if with_meta:
+        os.replace(path("meta.json.tmp"), path("meta.json"))
+    if ann or (ann is None and n >= ANN_MIN_ROWS):
+        print(f"🧭 Building IVF index over {n} vectors…")
+        with metrics.span("ann_build"):
+            save_ivf(out_dir, build_ivf(raw))
+    if bm25 is not None:
+        save_bm25(out_dir, bm25.build())
+    del raw
+    os.remove(path("vectors.f32.tmp"))
+
+
+def build_and_save(
+    chunks: list[str],
+    out_dir: str = ".ragcache",
+    batch_size: int = EMB_BATCH_SIZE,
+    concurrency: int = EMB_CONCURRENCY,
+    dtype: str = INDEX_DTYPE,
+    ann: bool | None = None,
+    meta: list[dict] | None = None,
+    lexical: bool = True,
+) -> dict:
+    """
+    Build (or incrementally update) the index in out_dir from a list of chunks
+    (and optional per-chunk meta). See build_from_stream for the details.
+    """
+    items = zip(chunks, meta) if meta is not None else ((c, None) for c in chunks)
+    return build_from_stream(items, out_dir=out_dir, batch_size=batch_size, concurrency=concurrency,
+                             dtype=dtype, ann=ann, with_meta=meta is not None, lexical=lexical)
+
+
+class ShardMeta(Sequence):
+    """One shard's meta.json, parsed on first access (a corpus query only touches a few shards)."""
+
+    def __init__(self, out_dir: str, rows: int):
+        self._path = os.path.join(out_dir, "meta.json")
+        self._rows = rows
+        self._meta = None
+
+    def __len__(self):
+        return self._rows
+
+    def __getitem__(self, i):
+        if self._meta is None:
+            meta = None
+            if os.path.exists(self._path):
+                with open(self._path) as f:
+                    meta = json.load(f)
+            self._meta = meta if meta is not None and len(meta) == self._rows else [None] * self._rows
+        return self._meta[i]
+
+
+class ConcatChunks(Sequence):
+    """Chunk sequences of several shards viewed as one list."""
+
+    def __init__(self, parts: list):
+        self._parts = parts
+        self._starts = np.cumsum([0] + [len(p) for p in parts])
+
+    def __len__(self):
+        return int(self._starts[-1])
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        i = int(i)
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        part = int(np.searchsorted(self._starts, i, side="right")) - 1
+        return self._parts[part][i - int(self._starts[part])]
+
+
+class ConcatRows:
+    """
+    Embedding matrices of several shards viewed as one (n, d) matrix. The
+    shards stay memory-mapped: slices and row lists only read the rows they
+    cover. With dequantize, rows come back as float32 with each shard's
+    scales applied (for shards stored at different dtypes, and for IVF
+    training). Scoring code can go shard by shard through `parts`.
+    """
+
+    def __init__(self, parts: list[dict], dequantize: bool = False):
+        self.parts = parts   # [{"embeddings", "scales"}] per shard
+        self._dequantize = dequantize
+        self._starts = np.cumsum([0] + [len(p["embeddings"]) for p in parts])
+        dims = {p["embeddings"].shape[1] for p in parts if len(p["embeddings"])}
+        self.shape = (int(self._starts[-1]), dims.pop() if dims else 0)
+        self.dtype = np.dtype(np.float32) if dequantize or not parts else parts[0]["embeddings"].dtype
+
+    def __len__(self):
+        return self.shape[0]
+
+    def _read(self, part: int, rows) -> np.ndarray:
+        p = self.parts[part]
+        return embedding_rows(p, rows) if self._dequantize else np.asarray(p["embeddings"][rows])
+
+    def __getitem__(self, i) -> np.ndarray:
+        if isinstance(i, slice):
+            start, stop, step = i.indices(len(self))
+            if step != 1:
+                return self[np.arange(start, stop, step)]
+            first = int(np.searchsorted(self._starts, start, side="right")) - 1
+            pieces = []
+            for part in range(max(first, 0), len(self.parts)):
+                lo, hi = int(self._starts[part]), int(self._starts[part + 1])
+                if lo >= stop:
+                    break
+                if hi > start:
+                    pieces.append(self._read(part, slice(max(start, lo) - lo, min(stop, hi) - lo)))
+            return np.concatenate(pieces) if pieces else np.zeros((0, self.shape[1]), self.dtype)
+        if np.isscalar(i):
+            return self[[int(i)]][0]
+        rows = np.asarray(i, dtype=np.int64)
+        rows = np.where(rows < 0, rows + len(self), rows)
+        if len(rows) and (rows.min() < 0 or rows.max() >= len(self)):
+            raise IndexError(f"row index out of range for {len(self)} rows")
+        out = np.empty((len(rows), self.shape[1]), dtype=self.dtype)
+        part_of = np.searchsorted(self._starts, rows, side="right") - 1
+        for part in np.unique(part_of):
+            sel = part_of == part
+            out[sel] = self._read(int(part), rows[sel] - self._starts[part])
+        return out
+
+    def __array__(self, dtype=None, copy=None):
+        out = self[:]
+        return out if dtype is None else out.astype(dtype, copy=False)
+
+
+def _doc_ranges(meta: list[dict] | None) -> dict | None:
+    """{doc_id: (start_row, end_row)}; chunks of one document are contiguous."""
+    if meta is None:
+        return None
+    ranges = {}
+    for i, m in enumerate(meta):
+        start, _ = ranges.get(m["doc_id"], (i, i))
+        ranges[m["doc_id"]] = (start, i + 1)
+    return ranges
+
+
+def build_corpus(
+    shards: Iterable[dict],
+    out_dir: str,
+    prune: bool = False,
+    ann: bool | None = None,
+    **build_kwargs,
+) -> dict:
+    """
+    Write a sharded multi-document index: one build_and_save directory per
+    document under out_dir/shards/<doc_id>, plus corpus.json listing them.
+
+    `shards` items (any iterable, consumed one at a time) are
+    {"doc_id", "source", "chunks", "meta"}. A shard whose
+    chunks are unchanged is not rewritten, shards of documents not passed in
+    are kept (so adding one TOS only writes one shard) unless prune=True.
+    """
+    os.makedirs(os.path.join(out_dir, "shards"), exist_ok=True)
+    corpus_path = os.path.join(out_dir, "corpus.json")
+    entries = {}
+    if os.path.exists(corpus_path):
+        with open(corpus_path) as f:
+            entries = {e["doc_id"]: e for e in json.load(f)["shards"]}
+    stats = {"shards_written": 0, "shards_unchanged": 0, "reused": 0, "added": 0, "removed": 0}
+    seen = set()
+    for sh in shards:
+        seen.add(sh["doc_id"])
+        shard_dir = os.path.join(out_dir, "shards", sh["doc_id"])
+        manifest = _load_manifest(shard_dir)
+        hashes = [_chunk_hash(c) for c in sh["chunks"]]
+        if manifest and manifest.get("model") == EMB_MODEL and manifest.get("hashes") == hashes \
+                and sh["doc_id"] in entries:
+            stats["shards_unchanged"] += 1
+            stats["reused"] += len(hashes)
+            continue
+        st = build_and_save(sh["chunks"], out_dir=shard_dir, ann=False, meta=sh["meta"], lexical=False,
+                            **build_kwargs)
+        for key in ("reused", "added", "removed"):
+            stats[key] += st[key]
+        stats["shards_written"] += 1
+        entries[sh["doc_id"]] = {"doc_id": sh["doc_id"], "source": sh["source"], "rows": len(sh["chunks"])}
+
+    if prune:
+        for doc_id in [d for d in entries if d not in seen]:
+            shutil.rmtree(os.path.join(out_dir, "shards", doc_id), ignore_errors=True)
+            del entries[doc_id]
+
+    ordered = [entries[d] for d in sorted(entries)]
+    shard_dirs = [os.path.join(out_dir, "shards", e["doc_id"]) for e in ordered]
+    total = sum(e["rows"] for e in ordered)
+    if ann or (ann is None and total >= ANN_MIN_ROWS):
+        # one IVF over the whole corpus; reuse trained centroids when we have them
+        print(f"🧭 Building corpus IVF index over {total} vectors…")
+        previous = load_ivf(out_dir)
+        vecs = ConcatRows([_load_vectors(d) for d in shard_dirs], dequantize=True)
+        save_ivf(out_dir, build_ivf(vecs, centroids=previous["centroids"] if previous else None))
+    else:
+        remove_ivf(out_dir)
+    # BM25 statistics (df, average length) are corpus-wide, so one index over all shards;
+    # it only needs chunk text, so no embeddings are read
+    save_bm25(out_dir, build_bm25(ConcatChunks([LazyChunks(d) for d in shard_dirs])))
+    _replace_atomic(corpus_path, lambda f: f.write(json.dumps({"format": INDEX_FORMAT, "shards": ordered}).encode("utf-8")))
+    return stats
+
+
+def _load_vectors(out_dir: str) -> dict:
+    """A compact index's embeddings (memory-mapped) and int8 scales, if any."""
+    scales_path = os.path.join(out_dir, "scales.npy")
+    return {
+        "embeddings": np.load(os.path.join(out_dir, "embeddings.npy"), mmap_mode="r"),
+        "scales": np.load(scales_path) if os.path.exists(scales_path) else None,
+    }
+
+
+def _load_corpus(out_dir: str, entries: list[dict]) -> dict:
+    """
+    A sharded corpus as one index. Shard embeddings stay memory-mapped behind
+    a ConcatRows view and shard meta is only parsed when a hit needs it;
+    document ranges come from corpus.json (one shard per document).
+    """
+    dirs = [os.path.join(out_dir, "shards", e["doc_id"]) for e in entries]
+    parts = [_load_vectors(d) for d in dirs]
+    uniform = len({p["embeddings"].dtype for p in parts}) <= 1 and \
+        len({p["scales"] is not None for p in parts}) <= 1
+    scales = None
+    if uniform and parts and parts[0]["scales"] is not None:
+        scales = np.concatenate([p["scales"] for p in parts])   # 4 bytes a row
+    docs, start = {}, 0
+    for e in entries:
+        docs[e["doc_id"]] = (start, start + e["rows"])
+        start += e["rows"]
+    return {
+        # mixed precision across shards: the view dequantizes to float32
+        "embeddings": ConcatRows(parts, dequantize=not uniform),
+        "scales": scales,
+        "chunks": ConcatChunks([LazyChunks(d) for d in dirs]),
+        "meta": ConcatChunks([ShardMeta(d, e["rows"]) for d, e in zip(dirs, entries)]),
+        "docs": docs,
+        "ivf": load_ivf(out_dir),
+        "lexical": load_bm25(out_dir),
+    }
 
-def _embed_batch(texts: list[str]) -> np.ndarray:
-    # simple loop; Ollama embeddings emulate OpenAI endpoint one-by-one
-    out = []
-    for t in tqdm(texts, desc=f"Embedding ({EMB_MODEL})"):
-        resp = _client.embeddings.create(model=EMB_MODEL, input=t)
-        out.append(resp.data[0].embedding)
-    arr = np.array(out, dtype=np.float32)
-    arr /= (np.linalg.norm(arr, axis=1, keepdims=True) + 1e-12)
-    return arr
-
-def build_and_save(chunks: list[str], out_dir: str = ".ragcache"):
-    os.makedirs(out_dir, exist_ok=True)
-    vecs = _embed_batch(chunks)
-    np.save(os.path.join(out_dir, "embeddings.npy"), vecs)
-    with open(os.path.join(out_dir, "chunks.json"), "w") as f:
-        json.dump(chunks, f)
 
 def load_index(out_dir: str = ".ragcache"):
-    vecs = np.load(os.path.join(out_dir, "embeddings.npy"))
-    with open(os.path.join(out_dir, "chunks.json")) as f:
-        chunks = json.load(f)
-    return {"embeddings": vecs, "chunks": chunks}
+    """
+    Load an index directory. Embeddings are memory-mapped and chunk text is
+    read lazily; directories written before the compact format
+    (embeddings.npy + chunks.json) are still loaded the old way.
+    Sharded corpora (corpus.json) are loaded as one index over all shards.
+    """
+    _recover(out_dir)
+    corpus_path = os.path.join(out_dir, "corpus.json")
+    if os.path.exists(corpus_path):
+        with open(corpus_path) as f:
+            return _load_corpus(out_dir, json.load(f)["shards"])
 
+    if not os.path.exists(os.path.join(out_dir, "chunks.bin")):
+        vecs = np.load(os.path.join(out_dir, "embeddings.npy"))
+        with open(os.path.join(out_dir, "chunks.json")) as f:
+            chunks = json.load(f)
+        return {"embeddings": vecs, "chunks": chunks}
 
+    meta_path = os.path.join(out_dir, "meta.json")
+    meta = None
+    if os.path.exists(meta_path):
+        with open(meta_path) as f:
+            meta = json.load(f)
+    return {
+        **_load_vectors(out_dir),
+        "chunks": LazyChunks(out_dir),
+        "meta": meta,
+        "docs": _doc_ranges(meta),
+        "ivf": load_ivf(out_dir),
+        "lexical": load_bm25(out_dir),
+    }
@@ -0,0 +1,140 @@
+# toscheck/lexical.py
+"""
+BM25 inverted index over an index's chunks, stored next to embeddings.npy
+as bm25_terms.json (vocabulary) plus CSR-style posting arrays. Terms are
+lowercased word tokens and adjacent word pairs, so a phrase like
+"class action" scores as a unit, not just as two common words.
+Scoring needs no embedding server.
+"""
+import os
+import re
+import json
+import math
+import threading
+from array import array
+from collections import Counter
+from collections.abc import Iterable
+import numpy as np
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+_ARRAYS = ("offsets", "rows", "tf", "doclen")
+
+
+def tokenize(text: str) -> list[str]:
+    return _TOKEN.findall(text.lower())
+
+
+def _terms(tokens: list[str]) -> list[str]:
+    return tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+
+
+class BM25Builder:
+    """Accumulates postings one chunk at a time (rows in insertion order)."""
+
+    def __init__(self):
+        self.vocab: dict[str, int] = {}
+        # flat postings in typed arrays: ~4 bytes per entry instead of a list of ints
+        self._ids = array("q")
+        self._rows = array("i")
+        self._tf = array("i")
+        self._doclen = array("i")
+
+    def add(self, text: str):
+        row = len(self._doclen)
+        tokens = tokenize(text)
+        self._doclen.append(len(tokens))
+        counts = Counter(_terms(tokens))
+        vocab = self.vocab
+        self._ids.extend([vocab[t] if t in vocab else vocab.setdefault(t, len(vocab)) for t in counts])
+        self._tf.extend(counts.values())
+        self._rows.extend([row] * len(counts))
+
+    def build(self) -> dict:
+        ids = np.frombuffer(self._ids, dtype=np.int64)
+        order = np.argsort(ids, kind="stable")   # rows stay ascending within each term
+        offsets = np.zeros(len(self.vocab) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(ids, minlength=len(self.vocab)))
+        return {
+            "terms": list(self.vocab),
+            "offsets": offsets,
+            "rows": np.frombuffer(self._rows, dtype=np.int32)[order],
+            "tf": np.frombuffer(self._tf, dtype=np.int32)[order].astype(np.float32),
+            "doclen": np.array(self._doclen, dtype=np.int32),
+        }
+
+
+def build_bm25(chunks: Iterable[str]) -> dict:
+    b = BM25Builder()
+    for c in chunks:
+        b.add(c)
+    return b.build()
+
+
+def save_bm25(out_dir: str, lex: dict):
+    path = os.path.join(out_dir, "bm25_terms.json")
+    with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+        json.dump(lex["terms"], f, ensure_ascii=False)
+    os.replace(f"{path}.tmp", path)
+    for name in _ARRAYS:
+        path = os.path.join(out_dir, f"bm25_{name}.npy")
+        with open(f"{path}.tmp", "wb") as f:
+            np.save(f, lex[name])
+        os.replace(f"{path}.tmp", path)
+
+
+class BM25:
+    """
+    A saved BM25 index. Postings are memory-mapped; the vocabulary is read on
+    the first query, so loading an index stays cheap for dense-only use.
+    """
+
+    def __init__(self, out_dir: str):
+        self.out_dir = out_dir
+        self._vocab = None
+        self._lock = threading.Lock()
+        arr = lambda name, **kw: np.load(os.path.join(out_dir, f"bm25_{name}.npy"), **kw)
+        self.offsets = arr("offsets")
+        self.rows = arr("rows", mmap_mode="r")
+        self.tf = arr("tf", mmap_mode="r")
+        doclen = arr("doclen").astype(np.float32)
+        avgdl = float(doclen.mean()) if len(doclen) else 1.0
+        # per-row length normalisation, the only doc-dependent part of the denominator
+        self.norm = BM25_K1 * (1 - BM25_B + BM25_B * doclen / max(avgdl, 1e-9))
+
+    def __len__(self):
+        return len(self.norm)
+
+    @property
+    def vocab(self) -> dict[str, int]:
+        with self._lock:
+            if self._vocab is None:
+                with open(os.path.join(self.out_dir, "bm25_terms.json"), encoding="utf-8") as f:
+                    self._vocab = {t: i for i, t in enumerate(json.load(f))}
+            return self._vocab
+
+    def scores(self, query: str) -> np.ndarray:
+        """BM25 score of every row for `query` (0 where no query term occurs)."""
+        n = len(self)
+        out = np.zeros(n, dtype=np.float32)
+        vocab = self.vocab
+        for term in dict.fromkeys(_terms(tokenize(query))):
+            t = vocab.get(term)
+            if t is None:
+                continue
+            lo, hi = self.offsets[t], self.offsets[t + 1]
+            rows = np.asarray(self.rows[lo:hi])
+            tf = np.asarray(self.tf[lo:hi])
+            idf = math.log(1 + (n - len(rows) + 0.5) / (len(rows) + 0.5))
+            out[rows] += idf * tf * (BM25_K1 + 1) / (tf + self.norm[rows])
+        return out
+
+
+def load_bm25(out_dir: str) -> BM25 | None:
+    paths = [os.path.join(out_dir, "bm25_terms.json")] + \
+        [os.path.join(out_dir, f"bm25_{name}.npy") for name in _ARRAYS]
+    if not all(os.path.exists(p) for p in paths):
+        return None
+    return BM25(out_dir)
@@ -1,15 +1,83 @@
 import os
+import time
+import hashlib
 from dotenv import load_dotenv
-from openai import OpenAI
+from toscheck.cache import get_generation_cache
+from toscheck.clients import get_client
+from toscheck import metrics
 load_dotenv()
 
 GEN_MODEL = os.environ.get("OLLAMA_GEN_MODEL", "llama3.1:8b")
-_client = OpenAI(
-    base_url=os.environ.get("OPENAI_BASE_URL", "http://localhost:11434/v1"),
-    api_key=os.environ.get("OPENAI_API_KEY", "ollama"),
-)
 
-def answer_with_rag(query: str, retrieved: list[dict], temperature: float = 0.0) -> str:
+def _cache_key(prompt: str, model: str, temperature: float) -> str:
+    digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+    return f"{model}\x00{temperature!r}\x00{digest}"
+
+
+def cached_answer(prompt: str, model: str | None = None, temperature: float = 0.0) -> str | None:
+    """Generation-cache lookup for a prompt, without calling the model."""
+    cache = get_generation_cache()
+    hit = cache.get(_cache_key(prompt, model or GEN_MODEL, temperature)) if cache is not None else None
+    if hit is None:
+        return None
+    metrics.count("chat_cache_hits")
+    return hit.decode("utf-8")
+
+
+def remember(prompt: str, answer: str, model: str | None = None, temperature: float = 0.0):
+    """Store an answer for a prompt that was produced some other way (e.g. a batched request)."""
+    cache = get_generation_cache()
+    if cache is not None:
+        cache.put(_cache_key(prompt, model or GEN_MODEL, temperature), answer.encode("utf-8"))
+
+
+def generate(
+    prompt: str,
+    model: str | None = None,
+    temperature: float = 0.0,
+    timeout: float | None = None,
+    use_cache: bool = True,
+) -> str:
+    """
+    One chat completion for a single user prompt, through the persistent
+    generation cache keyed on (model, temperature, sha256(prompt)).
+    Errors are raised and never cached.
+    """
+    model = model or GEN_MODEL
+    if use_cache:
+        hit = cached_answer(prompt, model, temperature)
+        if hit is not None:
+            return hit
+
+    # only pass timeout when set: None would disable the client's default
+    extra = {"timeout": timeout} if timeout is not None else {}
+    t0 = time.perf_counter()
+    try:
+        resp = get_client().chat.completions.create(
+            model=model,
+            temperature=temperature,
+            messages=[{"role": "user", "content": prompt}],
+            **extra,
+        )
+    except Exception:
+        metrics.count("chat_errors")
+        raise
+    answer = resp.choices[0].message.content.strip()
+    if metrics.enabled():
+        metrics.observe("chat_request_seconds", time.perf_counter() - t0)
+        metrics.count("chat_requests")
+        metrics.count("chat_prompt_chars", len(prompt))
+        metrics.count("chat_completion_chars", len(answer))
+        usage = getattr(resp, "usage", None)
+        if usage is not None:
+            metrics.count("chat_prompt_tokens", usage.prompt_tokens or 0)
+            metrics.count("chat_completion_tokens", usage.completion_tokens or 0)
+    if use_cache:
+        remember(prompt, answer, model, temperature)
+    return answer
+
+
+def answer_with_rag(query: str, retrieved: list[dict], temperature: float = 0.0, use_cache: bool = True) -> str:
     context = "\n\n---\n\n".join(f"[{r['idx']}] {r['chunk']}" for r in retrieved)
     prompt = f"""You are analyzing Terms of Service. Use ONLY the context and cite by [chunk_id].
 Question: {query}
@@ -23,12 +91,5 @@ Answer with:
 - a final 1–2 sentence summary
 If the answer is not in the context, say: "Not found in provided context."
 """
-    resp = _client.chat.completions.create(
-        model=GEN_MODEL,
-        temperature=temperature,
-        messages=[{"role": "user", "content": prompt}],
-    )
-    return resp.choices[0].message.content.strip()
-
-
+    return generate(prompt, temperature=temperature, use_cache=use_cache)
 
@@ -0,0 +1,158 @@
+# toscheck/metrics.py
+"""
+Process-wide instrumentation: timed spans, counters and latency histograms.
+
+Off by default (TOSCHECK_METRICS=1 or enable() turns it on); while off,
+span() hands back a shared no-op context manager and count()/observe()
+return after one flag check, so the calls can stay in hot paths.
+Everything is aggregated in place (per-name totals and fixed histogram
+buckets), so memory does not grow with the size of a run.
+"""
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager, nullcontext
+
+# upper bounds in seconds (Prometheus-style, cumulative on export)
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_enabled = os.environ.get("TOSCHECK_METRICS", "0") == "1"
+_lock = threading.Lock()
+_spans: dict[str, list] = {}       # name -> [count, total_seconds, max_seconds]
+_counters: dict[str, float] = {}
+_hists: dict[str, list] = {}       # name -> [per-bucket counts + overflow, count, sum, max]
+_NOOP = nullcontext()
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def enable(flag: bool = True):
+    global _enabled
+    _enabled = flag
+
+
+def reset():
+    with _lock:
+        _spans.clear()
+        _counters.clear()
+        _hists.clear()
+
+
+@contextmanager
+def _timed(name: str):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        dt = time.perf_counter() - t0
+        with _lock:
+            s = _spans.setdefault(name, [0, 0.0, 0.0])
+            s[0] += 1
+            s[1] += dt
+            s[2] = max(s[2], dt)
+
+
+def span(name: str):
+    """Context manager adding the wall time of its body to span `name`."""
+    return _timed(name) if _enabled else _NOOP
+
+
+def count(name: str, value: float = 1):
+    if not _enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def observe(name: str, seconds: float):
+    """Record one latency sample in histogram `name`."""
+    if not _enabled:
+        return
+    i = 0
+    while i < len(BUCKETS) and seconds > BUCKETS[i]:
+        i += 1
+    with _lock:
+        h = _hists.get(name)
+        if h is None:
+            h = _hists[name] = [[0] * (len(BUCKETS) + 1), 0, 0.0, 0.0]
+        h[0][i] += 1
+        h[1] += 1
+        h[2] += seconds
+        h[3] = max(h[3], seconds)
+
+
+def _quantile(counts: list[int], total: int, q: float, mx: float) -> float:
+    # upper bound of the bucket holding the q-th sample (never above the max seen)
+    seen = 0
+    for bound, c in zip(BUCKETS, counts):
+        seen += c
+        if seen >= q * total:
+            return min(bound, round(mx, 6))
+    return round(mx, 6)
+
+
+def snapshot() -> dict:
+    """Current spans, counters and histograms as plain JSON-able dicts."""
+    with _lock:
+        spans = {k: {"count": c, "seconds": round(t, 6), "max_seconds": round(m, 6)}
+                 for k, (c, t, m) in _spans.items()}
+        counters = dict(_counters)
+        hists = {}
+        for k, (counts, n, total, mx) in _hists.items():
+            hists[k] = {
+                "count": n,
+                "sum": round(total, 6),
+                "mean": round(total / n, 6) if n else 0.0,
+                "max": round(mx, 6),
+                # bucket upper bounds, so these are "at most" values
+                "p50_le": _quantile(counts, n, 0.50, mx),
+                "p95_le": _quantile(counts, n, 0.95, mx),
+                "buckets": {str(b): c for b, c in zip(BUCKETS + ("+Inf",), counts)},
+            }
+    return {"spans": spans, "counters": counters, "histograms": hists}
+
+
+def _prom_name(name: str) -> str:
+    return "toscheck_" + "".join(ch if ch.isalnum() else "_" for ch in name)
+
+
+def to_prometheus(snap: dict) -> str:
+    lines = []
+    if snap["spans"]:
+        lines += ["# TYPE toscheck_span_seconds summary"]
+        for k, s in sorted(snap["spans"].items()):
+            lines += [f'toscheck_span_seconds_sum{{span="{k}"}} {s["seconds"]}',
+                      f'toscheck_span_seconds_count{{span="{k}"}} {s["count"]}']
+    for k, v in sorted(snap["counters"].items()):
+        name = _prom_name(k) + "_total"
+        lines += [f"# TYPE {name} counter", f"{name} {v}"]
+    for k, h in sorted(snap["histograms"].items()):
+        name = _prom_name(k)
+        lines.append(f"# TYPE {name} histogram")
+        cum = 0
+        for bound, c in h["buckets"].items():
+            cum += c
+            lines.append(f'{name}_bucket{{le="{bound}"}} {cum}')
+        lines += [f"{name}_sum {h['sum']}", f"{name}_count {h['count']}"]
+    return "\n".join(lines) + "\n"
+
+
+def write(path: str, snap: dict | None = None):
+    """
+    Write a snapshot to `path`: Prometheus text format for .prom/.txt,
+    otherwise one JSON object per metric appended as JSON lines (so repeated
+    runs accumulate in one file).
+    """
+    snap = snap or snapshot()
+    if path.endswith((".prom", ".txt")):
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(to_prometheus(snap))
+        return
+    ts = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+    with open(path, "a", encoding="utf-8") as f:
+        for kind in ("spans", "counters", "histograms"):
+            for name, value in sorted(snap[kind].items()):
+                f.write(json.dumps({"ts": ts, "type": kind[:-1], "name": name, "value": value}) + "\n")
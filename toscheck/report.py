@@ -23,12 +23,15 @@ def write_outputs(query: str, hits: list[dict], answer: str, json_path: str | No
                 f.write(f"### [{idx}] (score {score:.3f})\n\n{chunk}\n\n---\n")
 
 
-def write_explanations(query: str, explanations: list[dict], json_path: str | None, md_path: str | None):
+def write_explanations(query: str, explanations: list[dict], json_path: str | None, md_path: str | None,
+                       stats: dict | None = None):
     payload = {
         "query": query,
         "generated_at": datetime.utcnow().isoformat() + "Z",
         "explanations": explanations,
     }
+    if stats:
+        payload["stats"] = stats
 
     if json_path:
         with open(json_path, "w") as f:
@@ -36,36 +39,150 @@ def write_explanations(query: str, explanations: list[dict], json_path: str | No
 
     if md_path:
         with open(md_path, "w") as f:
-            f.write(f"# Explanation Results\n\n")
-            f.write(f"_Query:_ **{query}**\n\n")
+            _md_header(f, query)
             for n, item in enumerate(explanations, 1):
-                clause = item.get("clause", "")
-                ans = item.get("answer", "")
-                pats = item.get("patterns", [])
-
-                # try to extract category hint from the LLM's last line
-                likely_cat = ""
-                for line in ans.splitlines()[::-1]:
-                    if "Likely category:" in line:
-                        likely_cat = line.strip()
-                        break
-
-                title = f"## Clause {n}"
-                if likely_cat:
-                    title += f" — {likely_cat.replace('Likely category:','').strip()}"
-                f.write(title + "\n\n")
-
-                f.write(f"**Clause text:**\n\n> {clause}\n\n")
-                f.write(f"**Matched patterns from KB:**\n\n")
-                if not pats:
-                    f.write("- (no close KB matches)\n\n")
-                else:
-                    for p in pats:
-                        idx = p.get("idx")
-                        score = p.get("score", 0.0)
-                        chunk = p.get("chunk", "")
-                        # show only first 500 chars for readability
-                        display = chunk[:500] + ("…" if len(chunk) > 500 else "")
-                        f.write(f"- **[{idx}]** (score {score:.3f}) — {display}\n")
-                f.write("\n**Explanation:**\n\n")
-                f.write(ans + "\n\n---\n")
+                _md_clause(f, n, item)
+
+
+def _md_header(f, query: str):
+    f.write(f"# Explanation Results\n\n")
+    f.write(f"_Query:_ **{query}**\n\n")
+
+
+def _md_clause(f, n: int, item: dict):
+    clause = item.get("clause", "")
+    ans = item.get("answer", "")
+    pats = item.get("patterns", [])
+
+    # try to extract category hint from the LLM's last line
+    likely_cat = ""
+    for line in ans.splitlines()[::-1]:
+        if "Likely category:" in line:
+            likely_cat = line.strip()
+            break
+
+    title = f"## Clause {n}"
+    if likely_cat:
+        title += f" — {likely_cat.replace('Likely category:','').strip()}"
+    f.write(title + "\n\n")
+
+    f.write(f"**Clause text:**\n\n> {clause}\n\n")
+    if "flags" in item:
+        f.write(f"**Rule flags:** {', '.join(item['flags']) or '(none)'}\n\n")
+    f.write(f"**Matched patterns from KB:**\n\n")
+    if not pats:
+        f.write("- (no close KB matches)\n\n")
+    else:
+        for p in pats:
+            idx = p.get("idx")
+            score = p.get("score", 0.0)
+            chunk = p.get("chunk", "")
+            # show only first 500 chars for readability
+            display = chunk[:500] + ("…" if len(chunk) > 500 else "")
+            f.write(f"- **[{idx}]** (score {score:.3f}) — {display}\n")
+    f.write("\n**Explanation:**\n\n")
+    f.write(ans + "\n\n---\n")
+
+
+class ExplanationStream:
+    """
+    Writes explained clauses to Markdown and JSON lines as they finish.
+
+    The JSONL file is also the checkpoint: a header line with the run's
+    `settings`, then one line per clause. Reopening it with the same settings
+    loads the clauses that were answered into `done` ({clause_idx: result}),
+    for explain_tos_with_kb(resume=...); a torn last line from a crash is cut
+    off, and the Markdown is rewritten from the checkpoint before appending.
+    Different settings (or resume=False) start a fresh report.
+    """
+
+    def __init__(self, query: str, jsonl_path: str, md_path: str | None, settings: dict, resume: bool = True):
+        self.done = {}
+        self.path = jsonl_path
+        good = self._load(settings) if resume else 0
+        if good:
+            self._jsonl = open(jsonl_path, "r+b")
+            self._jsonl.truncate(good)
+            self._jsonl.seek(good)
+        else:
+            self._jsonl = open(jsonl_path, "wb")
+            self._line({"type": "header", "query": query, "settings": settings,
+                        "started_at": datetime.utcnow().isoformat() + "Z"})
+        self.query = query
+        self.md_path = md_path
+        self._md = None
+        if md_path:
+            self._md = open(md_path, "w")
+            _md_header(self._md, query)
+            for idx in sorted(self.done):
+                _md_clause(self._md, idx + 1, self.done[idx])
+            self._md.flush()
+
+    def _load(self, settings: dict) -> int:
+        """Byte offset just past the last complete clause line (0 = nothing usable)."""
+        try:
+            f = open(self.path, "rb")
+        except FileNotFoundError:
+            return 0
+        good = 0
+        with f:
+            for raw in f:
+                if not raw.endswith(b"\n"):
+                    break
+                try:
+                    rec = json.loads(raw)
+                except ValueError:
+                    break
+                if good == 0:
+                    if rec.get("type") != "header" or rec.get("settings") != settings:
+                        return 0
+                elif rec.get("type") != "clause":
+                    break     # end-of-run stats: a resumed run writes its own
+                elif rec.get("ok"):
+                    item = {k: v for k, v in rec.items() if k not in ("type", "ok")}
+                    self.done[item["clause_idx"]] = item
+                good += len(raw)
+        return good
+
+    def _line(self, rec: dict):
+        self._jsonl.write(json.dumps(rec, ensure_ascii=False).encode("utf-8") + b"\n")
+        self._jsonl.flush()
+
+    def write(self, item: dict, ok: bool = True):
+        """Append one clause; failed ones are reported but generated again on resume."""
+        self._line({"type": "clause", "ok": ok, **item})
+        if self._md is not None:
+            _md_clause(self._md, item["clause_idx"] + 1, item)
+            self._md.flush()
+
+    def close(self, stats: dict | None = None):
+        """
+        Finish the run: append `stats`, then rewrite the Markdown in clause
+        order (concurrent runs append it in completion order).
+        """
+        if stats:
+            self._line({"type": "stats", "stats": stats})
+        self._jsonl.close()
+        if self._md is None:
+            return
+        self._md.close()
+        latest = {}
+        with open(self.path, "rb") as f:
+            for raw in f:
+                rec = json.loads(raw)
+                if rec.get("type") == "clause":
+                    latest[rec["clause_idx"]] = rec
+        with open(self.md_path, "w") as f:
+            _md_header(f, self.query)
+            for idx in sorted(latest):
+                _md_clause(f, idx + 1, latest[idx])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        # interrupted: keep the checkpoint and the Markdown as far as they got
+        if not self._jsonl.closed:
+            self._jsonl.close()
+            if self._md is not None:
+                self._md.close()
@@ -1,11 +1,155 @@
 import numpy as np
-from toscheck.index import _embed_batch
+from toscheck import metrics
+from toscheck.index import _embed_batch, embedding_rows
+from toscheck.ann import ANN_MIN_ROWS, ANN_NPROBE, candidates
 
-def retrieve(query: str, data: dict, k: int = 6):
+MATCH_TILE = 2048     # query rows per similarity tile in match_many
+SCORE_BLOCK = 65536   # index rows dequantized at a time while scoring
+RRF_K = 60            # reciprocal rank fusion damping: score = sum 1 / (RRF_K + rank)
+FUSION_POOL = 50      # candidates taken from each ranking before fusing
+MODES = ("dense", "lexical", "hybrid")
+
+
+def _scores(Q: np.ndarray, data: dict) -> np.ndarray:
+    """
+    Cosine scores of query rows Q (m,d) against every index row -> (m,n).
+    Works on float32, float16 and int8+scale matrices (including memmaps)
+    by upcasting one block of index rows at a time, and on sharded corpora.
+    """
+    M = data["embeddings"]
+    parts = getattr(M, "parts", None)
+    if parts is not None:
+        # sharded corpus (index.ConcatRows): score shard by shard, straight off each memmap
+        if not parts:
+            return np.zeros((len(Q), 0), dtype=np.float32)
+        return np.concatenate([_scores(Q, p) for p in parts], axis=1)
+    scales = data.get("scales")
+    if M.dtype == np.float32 and scales is None:
+        return Q @ M.T
+    out = np.empty((len(Q), len(M)), dtype=np.float32)
+    for start in range(0, len(M), SCORE_BLOCK):
+        block = np.asarray(M[start:start + SCORE_BLOCK], dtype=np.float32)
+        S = Q @ block.T
+        if scales is not None:
+            S *= scales[start:start + SCORE_BLOCK]
+        out[:, start:start + SCORE_BLOCK] = S
+    return out
+
+
+def _topk(sims: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k largest scores along the last axis, best first."""
+    n = sims.shape[-1]
+    k = min(k, n)
+    if k <= 0:
+        return np.zeros(sims.shape[:-1] + (0,), dtype=np.int64)
+    if k < n:
+        part = np.argpartition(-sims, k - 1, axis=-1)[..., :k]
+    else:
+        part = np.broadcast_to(np.arange(n), sims.shape).copy()
+    order = np.argsort(-np.take_along_axis(sims, part, axis=-1), axis=-1, kind="stable")
+    return np.take_along_axis(part, order, axis=-1)
+
+
+def _hit(data: dict, i: int, score: float) -> dict:
+    hit = {"idx": int(i), "score": float(score), "chunk": data["chunks"][int(i)]}
+    meta = data.get("meta")
+    if meta:
+        hit["meta"] = meta[int(i)]
+    return hit
+
+
+def _doc_rows(data: dict, docs: list[str]) -> np.ndarray:
+    """Row ids belonging to the given doc_ids (needs an index with metadata)."""
+    ranges = data.get("docs")
+    if ranges is None:
+        raise ValueError("This index has no per-document metadata; rebuild it to filter by document")
+    parts = [np.arange(*ranges[d]) for d in docs if d in ranges]
+    return np.concatenate(parts) if parts else np.zeros(0, dtype=np.int64)
+
+
+def retrieve(
+    query: str,
+    data: dict,
+    k: int = 6,
+    nprobe: int = ANN_NPROBE,
+    exact: bool | None = None,
+    docs: list[str] | None = None,
+    mode: str = "dense",
+):
+    """
+    Top-k chunks for a query. Uses the IVF index (scanning `nprobe` lists)
+    when the index has one and holds at least ANN_MIN_ROWS rows, brute force
+    otherwise; `exact` forces one or the other. `docs` restricts scoring to
+    the rows of those doc_ids before anything is computed.
+
+    mode: "dense" (embeddings), "lexical" (BM25 only, no embedding request)
+    or "hybrid" (both rankings merged by reciprocal rank fusion; hit scores
+    are then RRF scores).
+    """
+    if mode not in MODES:
+        raise ValueError(f"Unknown retrieval mode {mode!r} (expected one of {', '.join(MODES)})")
+    metrics.count("retrieve_queries")
+    if mode == "lexical":
+        with metrics.span("search"):
+            return _lexical(query, data, k, docs)
     qv = _embed_batch([query])[0]  # (d,)
-    M = data["embeddings"]         # (n,d) normalized
-    sims = M @ qv                  # cosine via dot
-    idx = np.argsort(-sims)[:k]
-    return [{"idx": int(i), "score": float(sims[i]), "chunk": data["chunks"][i]} for i in idx]
+    with metrics.span("search"):
+        if mode == "dense":
+            return _search(qv, data, k, nprobe, exact, docs)
+        pool = max(k, FUSION_POOL)
+        return _fuse([_search(qv, data, pool, nprobe, exact, docs), _lexical(query, data, pool, docs)], data, k)
+
+
+def _lexical(query: str, data: dict, k: int, docs: list[str] | None) -> list[dict]:
+    lex = data.get("lexical")
+    if lex is None:
+        raise ValueError("This index has no BM25 index; rebuild it to use lexical or hybrid retrieval")
+    scores = lex.scores(query)
+    rows = _doc_rows(data, docs) if docs else np.flatnonzero(scores)
+    rows = rows[scores[rows] > 0]   # rows sharing no term with the query are not hits
+    sims = scores[rows]
+    return [_hit(data, rows[i], sims[i]) for i in _topk(sims, k)]
+
+
+def _fuse(rankings: list[list[dict]], data: dict, k: int) -> list[dict]:
+    fused = {}
+    for hits in rankings:
+        for rank, h in enumerate(hits, 1):
+            fused[h["idx"]] = fused.get(h["idx"], 0.0) + 1.0 / (RRF_K + rank)
+    best = sorted(fused.items(), key=lambda kv: (-kv[1], kv[0]))[:k]
+    return [_hit(data, i, sc) for i, sc in best]
+
+
+def _search(qv: np.ndarray, data: dict, k: int, nprobe: int, exact: bool | None, docs: list[str] | None):
+    if docs:
+        rows = _doc_rows(data, docs)
+        sims = embedding_rows(data, rows) @ qv
+        return [_hit(data, rows[i], sims[i]) for i in _topk(sims, k)]
+
+    ivf = data.get("ivf")
+    if exact is None:
+        exact = ivf is None or len(data["embeddings"]) < ANN_MIN_ROWS
+    if not exact and ivf is not None:
+        cand = np.sort(candidates(ivf, qv, nprobe))  # sorted rows read the memmap in order
+        sims = embedding_rows(data, cand) @ qv
+        return [_hit(data, cand[i], sims[i]) for i in _topk(sims, k)]
+
+    sims = _scores(qv[None, :], data)[0]  # cosine via dot, (n,)
+    return [_hit(data, i, sims[i]) for i in _topk(sims, k)]
 
 
+def match_many(Q: np.ndarray, data: dict, k: int = 6, tile: int = MATCH_TILE) -> list[list[dict]]:
+    """
+    Top-k hits in `data` for every row of an already-embedded query matrix Q.
+    Scores are computed as one (tile x n) matrix product per tile of Q rows,
+    so nothing is re-embedded and memory stays bounded for large inputs.
+    """
+    out = []
+    with metrics.span("match"):
+        for start in range(0, len(Q), tile):
+            S = _scores(Q[start:start + tile], data)   # (tile, n) cosine
+            top = _topk(S, k)
+            scores = np.take_along_axis(S, top, axis=-1)
+            for row_idx, row_scores in zip(top, scores):
+                out.append([_hit(data, i, sc) for i, sc in zip(row_idx, row_scores)])
+    return out
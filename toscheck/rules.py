@@ -0,0 +1,200 @@
+# toscheck/rules.py
+"""
+Rule-based red-flag pre-screen. Phrases come from seeds.yml (category ->
+example clauses) and the SIGNALS / Keywords lines of the rag_patterns
+files, and are compiled into one matcher (see RuleSet), so tagging a
+clause is a single pass over its words.
+
+A phrase matches its content words in order, allowing word endings
+("class actions"; "governing law" is stemmed, so it also finds "governed
+by the laws") and, between two content words, as many filler words as
+the phrase itself has there plus RULE_SLACK. Boilerplate words ("do not",
+"third party", "personal information") are stop words, so they never
+match on their own. Seed sentences are examples, not templates: each
+contributes its runs of SEED_NGRAM consecutive content words ("binding
+arbitration", "waive ... class") rather than the whole sentence. KB
+signals are curated, so they are used as written, single words included
+("sell", "monitor", "telemetry").
+"""
+import os
+import re
+import json
+import hashlib
+from collections.abc import Iterable
+
+SEEDS_PATH = "seeds.yml"
+PATTERNS_DIR = "rag_patterns"
+
+_WORD = re.compile(r"[a-z0-9]+")
+_TEXT_WORD = re.compile(r"[A-Za-z0-9]+")
+_STOP = frozenset((
+    # function words
+    "a an the we you your our us i it its they them their he she his her me my of to in on at by for "
+    "from with as and or nor if unless than then so also is are was were be been being will "
+    "would may might can could must shall should this that these those such any all each every some "
+    "other others do does did done not no own into onto upon over under out up via per about which "
+    "who what when where how during within before after between while through "
+    # words nearly every TOS uses, whatever it says
+    "use uses used using time times service services site website app platform third party parties "
+    "provide provides provided information personal data user users customer customers support "
+    "business hours account accounts terms term agreement including include includes "
+    "details contact make made request requests"
+).split())
+RULE_SLACK = 2      # extra filler words allowed between content words
+SEED_NGRAM = 2      # content words per seed phrase
+_SIGNALS = re.compile(r"^#\s*SIGNALS:\s*(.+)$", re.MULTILINE)
+_KEYWORDS = re.compile(r"^-\s*Keywords:\s*(.+?)\.?$", re.MULTILINE)
+_CATEGORY = re.compile(r"^#\s*CATEGORY:\s*(.+)$", re.MULTILINE)
+_QUOTED = re.compile(r"[“\"]([^”\"]+)[”\"]")
+
+
+def _unquote(s: str) -> str:
+    if len(s) >= 2 and s[0] == s[-1] and s[0] in "\"'":
+        return s[1:-1]
+    return s
+
+
+def load_seeds(path: str = SEEDS_PATH) -> dict[str, list[str]]:
+    """
+    Parse seeds.yml: top-level "Category:" keys, each followed by a list of
+    "- example" lines. Just enough YAML for this file, so PyYAML isn't needed.
+    """
+    seeds: dict[str, list[str]] = {}
+    current = None
+    with open(path, encoding="utf-8") as f:
+        for n, line in enumerate(f, 1):
+            text = line.strip()
+            if not text or text.startswith("#"):
+                continue
+            if not line[0].isspace() and text.endswith(":"):
+                current = text[:-1].strip()
+                seeds.setdefault(current, [])
+            elif text.startswith("- ") and current is not None:
+                seeds[current].append(_unquote(text[2:].strip()))
+            else:
+                raise ValueError(f"{path}:{n}: expected 'Category:' or '- example', got {text!r}")
+    return seeds
+
+
+def pattern_signals(directory: str = PATTERNS_DIR) -> dict[str, list[str]]:
+    """{category: phrases} from the "# SIGNALS:" and "- Keywords:" lines of the KB pattern files."""
+    out: dict[str, list[str]] = {}
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith((".txt", ".md")):
+            continue
+        with open(os.path.join(directory, name), encoding="utf-8") as f:
+            text = f.read()
+        m = _CATEGORY.search(text)
+        category = m.group(1).strip().title() if m else os.path.splitext(name)[0]
+        phrases = [p for line in _SIGNALS.findall(text) for p in _QUOTED.findall(line)]
+        phrases += [p.strip() for line in _KEYWORDS.findall(text) for p in line.split(",")]
+        if phrases:
+            out.setdefault(category, []).extend(phrases)
+    return out
+
+
+def _expand(phrase: str) -> list[str]:
+    # "AAA/JAMS rules" -> "AAA rules", "JAMS rules"
+    alts = [[]]
+    for tok in phrase.split():
+        alts = [a + [o] for a in alts for o in tok.split("/") if o]
+    return [" ".join(a) for a in alts]
+
+
+def _stem(word: str) -> str:
+    # phrases match any word ending, so "governing law" should also find "governed by the laws"
+    for suffix in ("ing", "ed", "es", "s"):
+        if word.endswith(suffix) and len(word) - len(suffix) >= 4:
+            return word[:-len(suffix)]
+    return word
+
+
+def _phrase(text: str) -> list[tuple[str, int]]:
+    """[(content word stem, filler words allowed before it)] for a seed / signal text."""
+    out, fillers = [], 0
+    for w in _WORD.findall(text.lower()):
+        if w in _STOP:
+            fillers += 1
+        else:
+            out.append((_stem(w), fillers + RULE_SLACK))
+            fillers = 0
+    return out
+
+
+def _phrase_regex(phrase: list[tuple[str, int]]) -> str:
+    parts = [re.escape(phrase[0][0]) + r"\w*"]
+    for w, gap in phrase[1:]:
+        parts.append(rf"(?:\W+\w+){{0,{gap}}}?\W+" + re.escape(w) + r"\w*")
+    return r"\b" + "".join(parts)
+
+
+class RuleSet:
+    """
+    Compiled matcher: categories(text) lists the categories whose phrases
+    occur in text. Works like a word-level Aho-Corasick: one pass over the
+    words, each looked up (memoised) in a table of phrase-initial words, and
+    only the categories with a phrase starting there run their regex at
+    that position.
+    """
+
+    def __init__(self, phrases: dict[str, list[list[tuple[str, int]]]]):
+        self.names = [c for c, ps in phrases.items() if ps]
+        if not self.names:
+            raise ValueError("No rule phrases to compile")
+        self._each = []
+        self._starts: dict[str, set[int]] = {}
+        for i, c in enumerate(self.names):
+            alts = sorted({_phrase_regex(ph) for ph in phrases[c]}, key=lambda r: (-len(r), r))
+            self._each.append(re.compile("|".join(alts), re.IGNORECASE))
+            for ph in phrases[c]:
+                self._starts.setdefault(ph[0][0], set()).add(i)
+        self._lengths = sorted({len(w) for w in self._starts})
+        self._memo: dict[str, tuple[int, ...]] = {}
+        # identifies the compiled rules, e.g. for a scan checkpoint's settings
+        self.digest = hashlib.sha256(
+            json.dumps([[c, r.pattern] for c, r in zip(self.names, self._each)]).encode("utf-8")
+        ).hexdigest()
+
+    def _candidates(self, word: str) -> tuple[int, ...]:
+        # phrases match word endings, so any phrase-initial word that is a prefix counts
+        hit = self._memo.get(word)
+        if hit is None:
+            found = set()
+            for n in self._lengths:
+                if n > len(word):
+                    break
+                found |= self._starts.get(word[:n], set())
+            hit = self._memo[word] = tuple(sorted(found))
+        return hit
+
+    def categories(self, text: str) -> list[str]:
+        found = set()
+        for m in _TEXT_WORD.finditer(text):
+            for i in self._candidates(m.group(0).lower()):
+                if i not in found and self._each[i].match(text, m.start()):
+                    found.add(i)
+        return [self.names[i] for i in sorted(found)]
+
+    def scan(self, texts: Iterable[str]) -> list[list[str]]:
+        return [self.categories(t) for t in texts]
+
+
+def _ngrams(phrase: list[tuple[str, int]], n: int) -> list[list[tuple[str, int]]]:
+    # the first word's gap is irrelevant once it starts a phrase
+    if len(phrase) <= n:
+        return [phrase] if phrase else []
+    return [phrase[i:i + n] for i in range(len(phrase) - n + 1)]
+
+
+def load_rules(seeds: str | None = SEEDS_PATH, patterns_dir: str | None = PATTERNS_DIR) -> RuleSet:
+    """RuleSet from a seeds file and/or a KB pattern directory (either may be None or missing)."""
+    phrases: dict[str, list[list[tuple[str, int]]]] = {}
+    if seeds and os.path.exists(seeds):
+        for category, examples in load_seeds(seeds).items():
+            for ex in examples:
+                phrases.setdefault(category, []).extend(_ngrams(_phrase(ex), SEED_NGRAM))
+    if patterns_dir and os.path.isdir(patterns_dir):
+        for category, signals in pattern_signals(patterns_dir).items():
+            for s in signals:
+                phrases.setdefault(category, []).extend(ph for alt in _expand(s) if (ph := _phrase(alt)))
+    return RuleSet(phrases)
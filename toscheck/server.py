@@ -0,0 +1,231 @@
+# toscheck/server.py
+"""
+Long-running local HTTP service (`toscheck serve`): ask / explain / index
+over JSON, with indexes kept in memory between requests and one shared
+OpenAI-compatible client (see clients.py) for all of them.
+
+    POST /ask      {"query": "...", "cache": ".ragcache", "k": 6, "mode": "hybrid"}
+    POST /explain  {"query": "...", "cache": ".ragcache", "kb": "kb_rag", "all_chunks": true}
+    POST /index    {"input": "path/or/dir" | "url": "...", "cache": ".ragcache"}
+    GET  /health   loaded indexes
+    GET  /metrics  Prometheus text (see metrics.py)
+"""
+import os
+import json
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from toscheck import metrics
+from toscheck.ann import ANN_NPROBE
+from toscheck.chunk import iter_document_chunks
+from toscheck.explain import explain_tos_with_kb
+from toscheck.extract import iter_documents
+from toscheck.index import load_index, build_from_stream, EMB_BATCH_SIZE, EMB_CONCURRENCY, INDEX_DTYPE
+from toscheck.llm import answer_with_rag
+from toscheck.retrieve import retrieve
+from toscheck.rules import load_rules, SEEDS_PATH, PATTERNS_DIR
+
+# the file each index layout writes last (corpus, compact, legacy); its
+# mtime/size changes exactly when a rebuild has finished
+_VERSION_FILES = ("corpus.json", "manifest.json", "embeddings.npy")
+
+
+class IndexStore:
+    """Loaded indexes by directory, reloaded when their files change on disk."""
+
+    def __init__(self):
+        self._entries: dict[str, tuple] = {}   # abs path -> (signature, data)
+        self._locks: dict[str, threading.Lock] = {}
+        self._guard = threading.Lock()
+
+    @staticmethod
+    def _signature(path: str) -> tuple:
+        for name in _VERSION_FILES:
+            try:
+                st = os.stat(os.path.join(path, name))
+            except FileNotFoundError:
+                continue
+            return name, st.st_mtime_ns, st.st_size
+        raise FileNotFoundError(f"No index found in {path}")
+
+    def lock(self, path: str) -> threading.Lock:
+        """Per-directory lock: held while (re)loading or rebuilding that index."""
+        path = os.path.abspath(path)
+        with self._guard:
+            return self._locks.setdefault(path, threading.Lock())
+
+    def get(self, path: str) -> dict:
+        path = os.path.abspath(path)
+        entry = self._entries.get(path)
+        try:
+            sig = self._signature(path)
+        except FileNotFoundError:
+            if entry is None:
+                raise
+            return entry[1]   # a rebuild is swapping the directory in right now
+        if entry is not None and entry[0] == sig:
+            return entry[1]
+        with self.lock(path):
+            # another request may have reloaded it while we waited
+            sig = self._signature(path)
+            entry = self._entries.get(path)
+            if entry is None or entry[0] != sig:
+                print(f"🔄 Loading index {path}")
+                with metrics.span("load"):
+                    entry = (sig, load_index(path))
+                self._entries[path] = entry
+        return entry[1]
+
+    def loaded(self) -> list[str]:
+        return sorted(self._entries)
+
+
+def _optional_float(req: dict, key: str) -> float | None:
+    # float() like the other numeric fields, so "30" works and "abc" is a 400
+    return float(req[key]) if req.get(key) is not None else None
+
+
+_ANN_MODES = {"auto": None, "on": True, "off": False}
+
+
+def _ann_mode(req: dict) -> bool | None:
+    # same choices as `toscheck index --ann`; JSON booleans/null also work
+    value = req.get("ann")
+    if value is None or isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.lower() in _ANN_MODES:
+        return _ANN_MODES[value.lower()]
+    raise ValueError(f"ann must be one of auto, on, off (or true/false), got {value!r}")
+
+
+def handle_ask(store: IndexStore, req: dict, defaults: dict) -> dict:
+    query = req["query"]
+    data = store.get(req.get("cache", defaults["cache"]))
+    results = retrieve(query, data, k=int(req.get("k", 6)), nprobe=int(req.get("nprobe", ANN_NPROBE)),
+                       exact=True if req.get("exact") else None, docs=req.get("docs"),
+                       mode=req.get("mode", defaults["mode"]))
+    answer = answer_with_rag(query, results, use_cache=not req.get("no_cache", False))
+    return {"query": query, "results": results, "answer": answer}
+
+
+def handle_explain(store: IndexStore, req: dict, defaults: dict) -> dict:
+    query = req["query"]
+    stats = {}
+    results = explain_tos_with_kb(
+        query=query,
+        tos_cache=req.get("cache", defaults["cache"]),
+        kb_cache=req.get("kb", defaults["kb"]),
+        k_tos=int(req.get("k_tos", 8)),
+        k_kb=int(req.get("k_kb", 3)),
+        all_chunks=bool(req.get("all_chunks", False)),
+        kb_score_threshold=float(req.get("kb_threshold", 0.30)),
+        concurrency=int(req.get("concurrency", 1)),
+        timeout=_optional_float(req, "timeout"),
+        model=req.get("model"),
+        use_cache=not req.get("no_cache", False),
+        batch_tokens=int(req.get("batch_tokens", 0)),
+        skip_unmatched=bool(req.get("skip_unmatched", False)),
+        prescreen=load_rules(req.get("seeds", SEEDS_PATH), req.get("patterns", PATTERNS_DIR)) if req.get("prescreen") else None,
+        prescreen_kb_score=_optional_float(req, "prescreen_kb_score"),
+        stats=stats,
+        loader=store.get,
+    )
+    return {"query": query, "explanations": results, "stats": stats}
+
+
+def handle_index(store: IndexStore, req: dict, defaults: dict) -> dict:
+    if not req.get("input") and not req.get("url"):
+        raise ValueError("Provide input (file or directory) or url")
+    cache = req.get("cache", defaults["cache"])
+    ann = _ann_mode(req)
+    # one build per directory at a time; readers keep using the loaded copy
+    # until the rebuilt directory is swapped in, then reload on their next request
+    with store.lock(cache):
+        docs = iter_documents(req.get("input"), req.get("url"), workers=int(req.get("workers", 1)),
+                              timeout=_optional_float(req, "file_timeout"))
+        items = iter_document_chunks(docs, max_tokens=int(req.get("max_tokens", 500)),
+                                     overlap=int(req.get("overlap", 150)), tokenizer=req.get("tokenizer"))
+        st = build_from_stream(items, out_dir=cache, batch_size=int(req.get("emb_batch", EMB_BATCH_SIZE)),
+                               concurrency=int(req.get("emb_concurrency", EMB_CONCURRENCY)),
+                               dtype=req.get("dtype", INDEX_DTYPE), ann=ann, with_meta=True)
+    return {"cache": cache, **st}
+
+
+_ROUTES = {"/ask": handle_ask, "/explain": handle_explain, "/index": handle_index}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"   # keep-alive for clients sending many queries
+
+    def log_message(self, fmt, *args):
+        print(f"🌐 {self.address_string()} {fmt % args}")
+
+    def _send(self, code: int, body: bytes, ctype: str = "application/json"):
+        self.send_response(code)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _json(self, code: int, payload: dict):
+        self._send(code, json.dumps(payload, ensure_ascii=False).encode("utf-8"))
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._json(200, {"ok": True, "indexes": self.server.store.loaded()})
+        elif self.path == "/metrics":
+            self._send(200, metrics.to_prometheus(metrics.snapshot()).encode("utf-8"), "text/plain; version=0.0.4")
+        else:
+            self._json(404, {"error": f"Unknown path {self.path}"})
+
+    def do_POST(self):
+        handler = _ROUTES.get(self.path)
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if handler is None:
+            self._json(404, {"error": f"Unknown path {self.path}"})
+            return
+        try:
+            req = json.loads(body or b"{}")
+            if not isinstance(req, dict):
+                raise ValueError("Request body must be a JSON object")
+            with metrics.span(f"serve{self.path}"):
+                out = handler(self.server.store, req, self.server.defaults)
+        except KeyError as e:
+            self._json(400, {"error": f"Missing field {e}"})
+        except (ValueError, TypeError) as e:
+            self._json(400, {"error": str(e)})
+        except FileNotFoundError as e:
+            self._json(404, {"error": str(e)})
+        except Exception as e:
+            print(f"⚠️  {self.path} failed: {type(e).__name__}: {e}")
+            self._json(500, {"error": f"{type(e).__name__}: {e}"})
+        else:
+            self._json(200, out)
+
+
+class ToscheckServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int], defaults: dict):
+        super().__init__(address, _Handler)
+        self.store = IndexStore()
+        self.defaults = defaults
+
+
+def serve(host: str = "127.0.0.1", port: int = 8000, cache: str = ".ragcache", kb: str = "kb_rag",
+          mode: str = "dense", preload: bool = True):
+    """Run the service until interrupted. Default indexes are loaded up front if present."""
+    server = ToscheckServer((host, port), {"cache": cache, "kb": kb, "mode": mode})
+    if preload:
+        for path in (cache, kb):
+            try:
+                server.store.get(path)
+            except FileNotFoundError:
+                pass
+    print(f"🚀 Serving on http://{host}:{server.server_address[1]} (Ctrl+C to stop)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()